@@ -0,0 +1,272 @@
+# box_index.py
+import os
+import re
+import json
+import threading
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+
+# Side length (in processed-image pixels) of the grid cells used by the spatial index.
+GRID_CELL_SIZE = 200
+# Total number of boxes the cached indexes may hold before the least recently used ones are evicted.
+INDEX_CACHE_MAX_BOXES = int(os.environ.get("BOX_INDEX_CACHE_MAX_BOXES", "500000"))
+# Longest n-gram of the vocabulary index used for substring matches of query words.
+NGRAM_SIZE = 3
+
+def tokenize(text):
+    """Split text into lower-case word tokens for the inverted index."""
+    return re.findall(r"\w+", text.lower())
+
+def box_distance(boxA, boxB):
+    """Return the gap between two boxes (0 if they touch or overlap)."""
+    dx = max(boxB["x"] - (boxA["x"] + boxA["width"]), boxA["x"] - (boxB["x"] + boxB["width"]), 0)
+    dy = max(boxB["y"] - (boxA["y"] + boxA["height"]), boxA["y"] - (boxB["y"] + boxB["height"]), 0)
+    return (dx ** 2 + dy ** 2) ** 0.5
+
+class DocumentIndex:
+    """
+    In-memory index over the boxes of one processed document:
+    a uniform grid per page for rectangle queries and an inverted token index for text queries.
+    Partial word matches go through sorted vocabularies (prefixes and suffixes) and an n-gram
+    index of the vocabulary (substrings), built on the first text search.
+    """
+
+    def __init__(self, pages):
+        # pages: {page_number: page_data} as saved in text_extraction_page_N.json.
+        self.boxes = []
+        self.grid = defaultdict(lambda: defaultdict(list))
+        self.tokens = defaultdict(set)
+        # Occupied grid extent of each page (min_cx, min_cy, max_cx, max_cy); queries are clamped to it.
+        self.extents = {}
+        self._word_lookup = None
+        for page_num in sorted(pages):
+            for box in pages[page_num].get("boxes", []):
+                box_id = len(self.boxes)
+                self.boxes.append(dict(box, page=page_num))
+                for cell in self._cells(box["x"], box["y"], box["width"], box["height"]):
+                    self.grid[page_num][cell].append(box_id)
+                    min_cx, min_cy, max_cx, max_cy = self.extents.get(page_num, cell + cell)
+                    self.extents[page_num] = (min(min_cx, cell[0]), min(min_cy, cell[1]),
+                                              max(max_cx, cell[0]), max(max_cy, cell[1]))
+                for token in tokenize(box.get("text", "")):
+                    self.tokens[token].add(box_id)
+
+    @classmethod
+    def from_folder(cls, pdf_output_folder):
+        """Build the index from the text_extraction_page_N.json files of a document."""
+        pages = {}
+        for f in os.listdir(pdf_output_folder):
+            match = re.match(r"^text_extraction_page_(\d+)\.json$", f)
+            if match:
+                with open(os.path.join(pdf_output_folder, f), "r") as fp:
+                    pages[int(match.group(1))] = json.load(fp)
+        return cls(pages)
+
+    @staticmethod
+    def _cells(x, y, width, height, extent=None):
+        """Grid cells covered by a rectangle, limited to extent (min_cx, min_cy, max_cx, max_cy) if given."""
+        x1, y1 = int(min(x, x + width) // GRID_CELL_SIZE), int(min(y, y + height) // GRID_CELL_SIZE)
+        x2, y2 = int(max(x, x + width) // GRID_CELL_SIZE), int(max(y, y + height) // GRID_CELL_SIZE)
+        if extent is not None:
+            x1, y1 = max(x1, extent[0]), max(y1, extent[1])
+            x2, y2 = min(x2, extent[2]), min(y2, extent[3])
+        return [(cx, cy) for cx in range(x1, x2 + 1) for cy in range(y1, y2 + 1)]
+
+    def _candidates(self, page_num, x, y, width, height):
+        if page_num not in self.extents:
+            return []
+        page_grid = self.grid[page_num]
+        ids = set()
+        # Only the occupied part of the page is scanned, however large the query rectangle is.
+        for cell in self._cells(x, y, width, height, self.extents[page_num]):
+            ids.update(page_grid.get(cell, ()))
+        return sorted(ids)
+
+    def _get_word_lookup(self):
+        """Return (sorted words, sorted reversed words, n-gram -> words), building them on first use."""
+        if self._word_lookup is None:
+            words = sorted(self.tokens)
+            grams = defaultdict(set)
+            for word in words:
+                for n in range(1, NGRAM_SIZE + 1):
+                    for i in range(len(word) - n + 1):
+                        grams[word[i:i + n]].add(word)
+            self._word_lookup = (words, sorted(word[::-1] for word in words), grams)
+        return self._word_lookup
+
+    @staticmethod
+    def _with_prefix(sorted_words, prefix):
+        start = bisect_left(sorted_words, prefix)
+        end = bisect_left(sorted_words, prefix + "\U0010ffff", start)
+        return sorted_words[start:end]
+
+    def _words_containing(self, token):
+        _, _, grams = self._get_word_lookup()
+        if len(token) <= NGRAM_SIZE:
+            return grams.get(token, set())
+        # Every n-gram of the token must occur in the word; check the few remaining words directly.
+        gram_sets = sorted((grams.get(token[i:i + NGRAM_SIZE], set())
+                            for i in range(len(token) - NGRAM_SIZE + 1)), key=len)
+        return {word for word in set.intersection(*gram_sets) if token in word}
+
+    def _ids_for_words(self, words):
+        ids = set()
+        for word in words:
+            ids.update(self.tokens[word])
+        return ids
+
+    def _ids_for_token(self, token, match):
+        """Ids of the boxes with a word equal to token ("exact"), or starting / ending with / containing it."""
+        if match == "exact":
+            return self.tokens.get(token, set())
+        words, reversed_words, _ = self._get_word_lookup()
+        if match == "prefix":
+            matching = self._with_prefix(words, token)
+        elif match == "suffix":
+            matching = [word[::-1] for word in self._with_prefix(reversed_words, token[::-1])]
+        else:
+            matching = self._words_containing(token)
+        return self._ids_for_words(matching)
+
+    def boxes_in_rect(self, page_num, x, y, width, height, contained=False):
+        """
+        Return the boxes of a page that intersect the rectangle,
+        or that lie fully inside it if contained is True.
+        """
+        results = []
+        for box_id in self._candidates(page_num, x, y, width, height):
+            box = self.boxes[box_id]
+            if contained:
+                hit = (box["x"] >= x and box["y"] >= y and
+                       box["x"] + box["width"] <= x + width and box["y"] + box["height"] <= y + height)
+            else:
+                hit = not (box["x"] + box["width"] < x or box["x"] > x + width or
+                           box["y"] + box["height"] < y or box["y"] > y + height)
+            if hit:
+                results.append(box)
+        return results
+
+    def search(self, query, regex=False, page_num=None):
+        """
+        Return the boxes whose text contains query (case-insensitive), or matches it
+        as a regular expression if regex is True. Optionally limited to one page.
+        """
+        if regex:
+            pattern = re.compile(query, re.IGNORECASE)
+            ids = range(len(self.boxes))
+            matches = lambda text: pattern.search(text) is not None
+        else:
+            query_tokens = tokenize(query)
+            if query_tokens:
+                # Narrow down with the inverted index: the first query token must end a word of the
+                # box text, the last one must start a word and the ones in between must match whole words.
+                if len(query_tokens) == 1:
+                    candidate_sets = [self._ids_for_token(query_tokens[0], "contains")]
+                else:
+                    candidate_sets = [self._ids_for_token(token, "exact") for token in query_tokens[1:-1]]
+                    candidate_sets += [self._ids_for_token(query_tokens[0], "suffix"),
+                                       self._ids_for_token(query_tokens[-1], "prefix")]
+                ids = sorted(set.intersection(*candidate_sets))
+            else:
+                ids = range(len(self.boxes))
+            needle = query.lower()
+            matches = lambda text: needle in text.lower()
+        results = []
+        for box_id in ids:
+            box = self.boxes[box_id]
+            if page_num is not None and box["page"] != page_num:
+                continue
+            if matches(box.get("text", "")):
+                results.append(box)
+        return results
+
+    def near(self, anchor, max_distance=100, direction="any", regex=False, page_num=None, limit=10):
+        """
+        Find the boxes matching anchor and return, for each, the boxes within max_distance
+        pixels of it, nearest first. direction may be "any", "right" or "below".
+        """
+        results = []
+        for anchor_box in self.search(anchor, regex=regex, page_num=page_num):
+            neighbours = []
+            for box in self.boxes_in_rect(anchor_box["page"],
+                                          anchor_box["x"] - max_distance, anchor_box["y"] - max_distance,
+                                          anchor_box["width"] + 2 * max_distance,
+                                          anchor_box["height"] + 2 * max_distance):
+                if box is anchor_box:
+                    continue
+                if direction == "right":
+                    if box["x"] < anchor_box["x"] + anchor_box["width"] or \
+                            box["y"] > anchor_box["y"] + anchor_box["height"] or \
+                            box["y"] + box["height"] < anchor_box["y"]:
+                        continue
+                elif direction == "below":
+                    if box["y"] < anchor_box["y"] + anchor_box["height"] or \
+                            box["x"] > anchor_box["x"] + anchor_box["width"] or \
+                            box["x"] + box["width"] < anchor_box["x"]:
+                        continue
+                distance = box_distance(anchor_box, box)
+                if distance <= max_distance:
+                    neighbours.append((distance, box))
+            neighbours.sort(key=lambda item: item[0])
+            results.append({
+                "anchor": anchor_box,
+                "neighbours": [dict(box, distance=round(distance, 2)) for distance, box in neighbours[:limit]]
+            })
+        return results
+
+###############################################################################
+# LRU Cache of Document Indexes
+###############################################################################
+_index_cache = OrderedDict()
+_index_cache_boxes = 0
+_index_cache_lock = threading.Lock()
+
+def put_document_index(pdf_name, index):
+    """
+    Store the index of a document, evicting the least recently used ones while the cache holds
+    more than INDEX_CACHE_MAX_BOXES boxes (the newest index is always kept).
+    """
+    global _index_cache_boxes
+    with _index_cache_lock:
+        old_index = _index_cache.pop(pdf_name, None)
+        if old_index is not None:
+            _index_cache_boxes -= len(old_index.boxes)
+        _index_cache[pdf_name] = index
+        _index_cache_boxes += len(index.boxes)
+        while _index_cache_boxes > INDEX_CACHE_MAX_BOXES and len(_index_cache) > 1:
+            _, evicted = _index_cache.popitem(last=False)
+            _index_cache_boxes -= len(evicted.boxes)
+
+def drop_document_index(pdf_name):
+    """Remove a document's index from the cache (e.g. because its results changed)."""
+    global _index_cache_boxes
+    with _index_cache_lock:
+        index = _index_cache.pop(pdf_name, None)
+        if index is not None:
+            _index_cache_boxes -= len(index.boxes)
+
+def build_document_index(pdf_name, pdf_output_folder):
+    """Build the index of a processed document from its page JSON files and cache it."""
+    index = DocumentIndex.from_folder(pdf_output_folder)
+    put_document_index(pdf_name, index)
+    return index
+
+def index_page_results(pdf_name, results):
+    """Build the index of a document from the page data just produced by an extraction and cache it."""
+    index = DocumentIndex({page_data["page"]: page_data for page_data in results})
+    put_document_index(pdf_name, index)
+    return index
+
+def get_document_index(pdf_name, pdf_output_folder):
+    """
+    Return the cached index of a document, building it from its page JSON files
+    on a cache miss (e.g. after a restart or an eviction). Returns None if the document doesn't exist.
+    """
+    with _index_cache_lock:
+        index = _index_cache.get(pdf_name)
+        if index is not None:
+            _index_cache.move_to_end(pdf_name)
+            return index
+    if not os.path.isdir(pdf_output_folder):
+        return None
+    return build_document_index(pdf_name, pdf_output_folder)
@@ -118,8 +118,11 @@ def process_coordinates(original_path, processed_image_path, processed_json_path
 
 if __name__ == "__main__":
 
-    # 1. Read the saved paths from last_paths.json
-    with open("last_paths.json", "r") as f:
+    # 1. Read the saved paths from last_paths.json (or from the file given on the command line,
+    #    e.g. static/<pdf_name>/last_paths.json for a specific document).
+    import sys
+    paths_file = sys.argv[1] if len(sys.argv) > 1 else "last_paths.json"
+    with open(paths_file, "r") as f:
         paths_data = json.load(f)
 
     original_image_path = paths_data["original_image_path"]
@@ -5,13 +5,23 @@ import json
 import time
 import os
 import re
+import sys
+import shutil
+import math
+import uuid
+import argparse
+import threading
 from flask import Flask, request, jsonify, render_template, send_file, send_from_directory
+from werkzeug.utils import secure_filename
 from PIL import Image, ImageDraw
-from multiprocessing import Pool, cpu_count
 from pyzbar.pyzbar import decode
+from workers import (plan_workers, limit_worker_threads, worker_thread_limit, ocr_job_slots, JOB_QUEUE_TIMEOUT,
+                     pool_context, enable_shared_pools, get_shared_pool, run_with_thread_limit, imap_bounded)
+from page_cache import page_fingerprint, page_content_digest, settings_fingerprint, load_manifest, save_manifest
+from box_index import index_page_results, drop_document_index, get_document_index
+from page_templates import layout_key, apply_templates, learn_templates
 
 # OCR Modules
-import easyocr
 import pytesseract
 from pytesseract import Output
 
@@ -20,54 +30,385 @@ app = Flask(__name__)
 # Folders for uploads and static output.
 UPLOAD_FOLDER = "uploads"
 STATIC_FOLDER = "static"
+# Recent job ids per uploaded file name (latest first), used for incremental uploads and job retention.
+LATEST_JOBS_FOLDER = "latest_jobs"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(STATIC_FOLDER, exist_ok=True)
-
-# Global initialization for EasyOCR.
-easyocr_reader = easyocr.Reader(['en'])
+os.makedirs(LATEST_JOBS_FOLDER, exist_ok=True)
+
+# Job retention: the outputs of the latest OCR_JOBS_PER_FILE jobs of each file name are kept,
+# and any job older than OCR_JOB_TTL_HOURS is deleted (0 keeps jobs until they are superseded).
+JOBS_PER_FILE = max(int(os.environ.get("OCR_JOBS_PER_FILE", "3")), 1)
+JOB_TTL_HOURS = float(os.environ.get("OCR_JOB_TTL_HOURS", "24"))
+JOB_ID_PATTERN = re.compile(r"_[0-9a-f]{32}$")
+_job_history_lock = threading.Lock()
+
+# EasyOCR (and PyTorch) is only imported and loaded in the OCR worker processes, by their first
+# EasyOCR page (or, for the batched backend, by init_ocr_worker with --preload-easyocr), never in the server process.
+easyocr_reader = None
+_easyocr_reader_lock = threading.Lock()
+# Set by --preload-easyocr: the server's batched EasyOCR workers load the model when they start.
+preload_easyocr = False
+
+# Memory-bounded mode: at most this many pages are rendered/OCR'd at once, worker processes
+# are recycled after a few tasks, and only small per-page summaries are kept in memory.
+MAX_INFLIGHT_PAGES = int(os.environ.get("OCR_MAX_INFLIGHT_PAGES", "4"))
+MEMORY_BOUNDED_TASKS_PER_CHILD = int(os.environ.get("OCR_TASKS_PER_CHILD", "16"))
+# Documents with at least this many pages always use memory-bounded mode.
+MEMORY_BOUNDED_MIN_PAGES = int(os.environ.get("OCR_MEMORY_BOUNDED_MIN_PAGES", "200"))
+
+# Batched EasyOCR backend: recognition batch size and how many pages share one recognition pass.
+EASYOCR_BATCH_SIZE = int(os.environ.get("EASYOCR_BATCH_SIZE", "32"))
+EASYOCR_PAGES_PER_BATCH = int(os.environ.get("EASYOCR_PAGES_PER_BATCH", "4"))
+# Worker processes (each with one model copy) per batched EasyOCR job; the job's CPUs go to their torch threads.
+EASYOCR_BATCHED_MAX_WORKERS = int(os.environ.get("EASYOCR_BATCHED_MAX_WORKERS", "2"))
+# Height EasyOCR resizes text crops to before recognition (as in Reader.recognize).
+EASYOCR_MODEL_HEIGHT = 64
+
+def get_easyocr_reader():
+    """Return the global EasyOCR reader, loading it on first use."""
+    global easyocr_reader
+    if easyocr_reader is None:
+        with _easyocr_reader_lock:
+            if easyocr_reader is None:
+                import easyocr
+                # PyTorch and OpenCV were just imported: apply this worker's thread cap to them.
+                threads = worker_thread_limit()
+                if threads:
+                    limit_worker_threads(threads)
+                easyocr_reader = easyocr.Reader(['en'])
+    return easyocr_reader
+
+def init_ocr_worker(preload_easyocr=False):
+    """Initializer of the server-wide pool's workers: optionally loads EasyOCR (threads are capped per task)."""
+    if preload_easyocr:
+        get_easyocr_reader()
+
+def ocr_pool(ocr_engine):
+    """
+    The server-wide pool the engine's tasks run on, or None outside the server (see workers.enable_shared_pools).
+    Batched EasyOCR has its own small pool, so only a few processes hold a copy of the model.
+    """
+    if ocr_engine == "easyocr_batched":
+        return get_shared_pool("easyocr_batched", EASYOCR_BATCHED_MAX_WORKERS, init_ocr_worker, (preload_easyocr,))
+    return get_shared_pool("ocr", initializer=init_ocr_worker)
+
+def write_json_atomic(path, data):
+    """Write JSON to a temporary file and move it into place, so readers never see a partial file."""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, path)
+
+def load_job_history(filename):
+    """Return the recent jobs of an uploaded file name: {"job_id": latest job, "jobs": [latest first]}."""
+    history_path = os.path.join(LATEST_JOBS_FOLDER, f"{filename}.json")
+    if not os.path.exists(history_path):
+        return {}
+    try:
+        with open(history_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print("Ignoring unreadable job history:", e)
+        return {}
+
+def delete_job(job_id):
+    """Delete the outputs of a job and its cached box index."""
+    shutil.rmtree(os.path.join(STATIC_FOLDER, job_id), ignore_errors=True)
+    drop_document_index(job_id)
+
+def record_job(filename, job_id):
+    """
+    Make job_id the latest job of filename, then apply the retention policy: delete the jobs
+    of filename beyond the latest JOBS_PER_FILE, and every job (and job history) older than JOB_TTL_HOURS.
+    """
+    with _job_history_lock:
+        previous_jobs = load_job_history(filename).get("jobs", [])
+        jobs = [job_id] + [old_job_id for old_job_id in previous_jobs if old_job_id != job_id]
+        for old_job_id in jobs[JOBS_PER_FILE:]:
+            delete_job(old_job_id)
+        write_json_atomic(os.path.join(LATEST_JOBS_FOLDER, f"{filename}.json"),
+                          {"job_id": job_id, "jobs": jobs[:JOBS_PER_FILE]})
+    if JOB_TTL_HOURS <= 0:
+        return
+    cutoff = time.time() - JOB_TTL_HOURS * 3600
+    for name in os.listdir(STATIC_FOLDER):
+        path = os.path.join(STATIC_FOLDER, name)
+        try:
+            if JOB_ID_PATTERN.search(name) and os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+                delete_job(name)
+        except OSError:
+            pass
+    for name in os.listdir(LATEST_JOBS_FOLDER):
+        path = os.path.join(LATEST_JOBS_FOLDER, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
 
 def is_bullet_or_number(text):
     """Return True if text looks like a bullet/number."""
     return bool(re.match(r'^(\d+\.)|([•\-])', text.strip()))
 
+###############################################################################
+# Shared Page Post-Processing Helpers
+###############################################################################
+
+def add_corner_points(x, y, width, height):
+    """Return the four corner points of an axis-aligned box."""
+    return {
+        "top_left": (x, y),
+        "top_right": (x + width, y),
+        "bottom_left": (x, y + height),
+        "bottom_right": (x + width, y + height)
+    }
+
+def detect_barcodes(np_image):
+    """Detect barcodes with pyzbar and return them as boxes tagged with source "barcode"."""
+    barcode_results = decode(np_image)
+    barcode_boxes = []
+    for barcode in barcode_results:
+        x, y, w, h = barcode.rect
+        barcode_text = barcode.data.decode("utf-8")
+        barcode_box = {
+            "text": f"Barcode ({barcode.type}): {barcode_text}",
+            "x": x,
+            "y": y,
+            "width": w,
+            "height": h,
+            "corners": add_corner_points(x, y, w, h),
+            "source": "barcode"  # Mark box as coming from barcode detection.
+        }
+        barcode_boxes.append(barcode_box)
+    return barcode_boxes
+
+def boxes_are_close_or_overlap(boxA, boxB, threshold=2, max_horizontal_gap=10, max_vertical_gap=2):
+    A_left = boxA["x"] - threshold
+    A_right = boxA["x"] + boxA["width"] + threshold
+    A_top = boxA["y"] - threshold
+    A_bottom = boxA["y"] + boxA["height"] + threshold
+    B_left = boxB["x"] - threshold
+    B_right = boxB["x"] + boxB["width"] + threshold
+    B_top = boxB["y"] - threshold
+    B_bottom = boxB["y"] + boxB["height"] + threshold
+    horizontal_overlap = not (A_right < B_left or A_left > B_right)
+    vertical_overlap = not (A_bottom < B_top or A_top > B_bottom)
+    if boxA["x"] + boxA["width"] < boxB["x"]:
+        horizontal_gap = boxB["x"] - (boxA["x"] + boxA["width"])
+    elif boxB["x"] + boxB["width"] < boxA["x"]:
+        horizontal_gap = boxA["x"] - (boxB["x"] + boxB["width"])
+    else:
+        horizontal_gap = 0
+    if boxA["y"] + boxA["height"] < boxB["y"]:
+        vertical_gap = boxB["y"] - (boxA["y"] + boxA["height"])
+    elif boxB["y"] + boxB["height"] < boxA["y"]:
+        vertical_gap = boxA["y"] - (boxB["y"] + boxB["height"])
+    else:
+        vertical_gap = 0
+    if horizontal_gap > max_horizontal_gap or vertical_gap > max_vertical_gap:
+        return False
+    return horizontal_overlap and vertical_overlap
+
+def merge_two_boxes(boxA, boxB):
+    merged_text = boxA["text"] + " " + boxB["text"]
+    min_x = min(boxA["x"], boxB["x"])
+    min_y = min(boxA["y"], boxB["y"])
+    max_x = max(boxA["x"] + boxA["width"], boxB["x"] + boxB["width"])
+    max_y = max(boxA["y"] + boxA["height"], boxB["y"] + boxB["height"])
+    width = max_x - min_x
+    height = max_y - min_y
+    corners = add_corner_points(min_x, min_y, width, height)
+    return {
+        "text": merged_text,
+        "x": min_x,
+        "y": min_y,
+        "width": width,
+        "height": height,
+        "corners": corners
+    }
+
+def build_grouped_boxes(ocr_results, conf_threshold):
+    """
+    Turn raw (bbox, word, conf) OCR results into line boxes:
+    words are grouped into lines and boxes that are very close are merged.
+    Words below conf_threshold are labelled as images/logos/symbols/signatures.
+    """
+    # Build a word_data list.
+    word_data = []
+    for bbox, word, conf in ocr_results:
+        label = word if (conf >= conf_threshold and word) else "Image/Logo/Symbol/Signature Detected"
+        x1, y1 = bbox[0]
+        x3, y3 = bbox[2]
+        word_data.append({
+            "text": label,
+            "x": int(x1),
+            "y": int(y1),
+            "width": int(x3 - x1),
+            "height": int(y3 - y1)
+        })
+
+    # Group words into lines.
+    word_data.sort(key=lambda w: (w["y"], w["x"]))
+    line_groups = []
+    line_threshold = 0.1
+    max_horizontal_gap = 19.5
+    current_group = []
+    for wd in word_data:
+        if not current_group:
+            current_group.append(wd)
+        else:
+            avg_y = sum(item["y"] for item in current_group) / len(current_group)
+            last_word = current_group[-1]
+            last_right = last_word["x"] + last_word["width"]
+            horizontal_gap = wd["x"] - last_right
+            if abs(wd["y"] - avg_y) <= line_threshold and horizontal_gap <= max_horizontal_gap:
+                if is_bullet_or_number(wd["text"]) and is_bullet_or_number(current_group[-1]["text"]):
+                    line_groups.append(current_group)
+                    current_group = [wd]
+                else:
+                    current_group.append(wd)
+            else:
+                line_groups.append(current_group)
+                current_group = [wd]
+    if current_group:
+        line_groups.append(current_group)
+
+    # Convert line groups into bounding boxes with corners.
+    grouped_boxes = []
+    for group in line_groups:
+        line_text = " ".join(item["text"] for item in group)
+        min_x = min(item["x"] for item in group)
+        min_y = min(item["y"] for item in group)
+        max_x = max(item["x"] + item["width"] for item in group)
+        max_y = max(item["y"] + item["height"] for item in group)
+        width = max_x - min_x
+        height = max_y - min_y
+        corners = add_corner_points(min_x, min_y, width, height)
+        grouped_boxes.append({
+            "text": line_text,
+            "x": min_x,
+            "y": min_y,
+            "width": width,
+            "height": height,
+            "corners": corners
+        })
+
+    return merge_close_boxes(grouped_boxes, max_horizontal_gap)
+
+def merge_close_boxes(grouped_boxes, max_horizontal_gap=19.5):
+    """Merge boxes that are very close or overlap, until no more boxes can be merged."""
+    merged = True
+    while merged and grouped_boxes:
+        merged = False
+        new_list = []
+        while grouped_boxes:
+            current = grouped_boxes.pop(0)
+            has_merged = False
+            for i, other in enumerate(grouped_boxes):
+                if boxes_are_close_or_overlap(current, other, threshold=10, max_horizontal_gap=max_horizontal_gap, max_vertical_gap=10):
+                    merged_box = merge_two_boxes(current, other)
+                    new_list.append(merged_box)
+                    grouped_boxes.pop(i)
+                    has_merged = True
+                    merged = True
+                    break
+            if not has_merged:
+                new_list.append(current)
+        grouped_boxes = new_list
+    return grouped_boxes
+
+def combine_template_boxes(grouped_boxes, cached_boxes, separator):
+    """
+    Template mode: combine the OCR'd boxes with the cached template boxes as if the whole page
+    had been OCR'd, merging close boxes across both sets and sorting them in reading order.
+    Returns (boxes, text), the text being rebuilt from the boxes in reading order.
+    """
+    combined = sorted(grouped_boxes + cached_boxes, key=lambda box: (box["y"], box["x"]))
+    combined = merge_close_boxes(combined)
+    combined.sort(key=lambda box: (box["y"], box["x"]))
+    return combined, separator.join(box["text"] for box in combined)
+
+def save_page_outputs(page_num, image, pdf_name, json_mode, grouped_boxes, text, ocr_color, barcode_color,
+                      fingerprint=None):
+    """
+    Draw the boxes onto the page image, save it and the page JSON, and return the page data.
+    The page's content fingerprint, if given, is returned with the page data but not saved in the JSON.
+    """
+    draw = ImageDraw.Draw(image)
+    for box in grouped_boxes:
+        x1, y1 = box["corners"]["top_left"]
+        x2, y2 = box["corners"]["bottom_right"]
+        if x2 < x1:
+            x1, x2 = x2, x1
+        if y2 < y1:
+            y1, y2 = y2, y1
+        color = barcode_color if box.get("source") == "barcode" else ocr_color
+        draw.rectangle([(x1, y1), (x2, y2)], outline=color, width=4)
+
+    pdf_output_folder = os.path.join(STATIC_FOLDER, pdf_name)
+    os.makedirs(pdf_output_folder, exist_ok=True)
+    output_image_path = os.path.join(pdf_output_folder, f"output_visualized_page_{page_num+1}.png")
+    image.save(output_image_path)
+    # Release the page bitmap right away; callers don't use the image after saving it.
+    image.close()
+
+    if json_mode == "with_text":
+        page_data = {
+            "page": page_num + 1,
+            "boxes": grouped_boxes,
+            "text": text
+        }
+    else:
+        page_data = {
+            "page": page_num + 1,
+            "boxes": [{
+                "x": box["x"],
+                "y": box["y"],
+                "width": box["width"],
+                "height": box["height"],
+                "corners": box["corners"]
+            } for box in grouped_boxes]
+        }
+    json_output_path = os.path.join(pdf_output_folder, f"text_extraction_page_{page_num+1}.json")
+    with open(json_output_path, "w") as f:
+        json.dump(page_data, f, indent=4)
+    if fingerprint is not None:
+        page_data["fingerprint"] = fingerprint
+    return page_data
+
 ###############################################################################
 # OCR Processing Functions (Module Level)
 ###############################################################################
 
-def process_page_tesseractOCR(page_num, pdf_path, pdf_name, render_resolution, json_mode, original_dims):
-    """Process a single PDF page using TesseractOCR with barcode detection (pyzbar)."""
+def process_page_tesseractOCR(page_num, pdf_path, pdf_name, render_resolution, json_mode, original_dims,
+                              template_mode=False):
+    """
+    Process a single PDF page using TesseractOCR with barcode detection (pyzbar).
+    With template_mode, regions identical to learned template regions reuse their cached boxes
+    and only the rest of the page is OCR'd (see page_templates.py).
+    """
     print(f"Processing Page {page_num + 1} with TesseractOCR...")
     with pdfplumber.open(pdf_path) as pdf:
         page = pdf.pages[page_num]
         image = page.to_image(resolution=render_resolution).original
-        draw = ImageDraw.Draw(image)
+        # Fingerprinted here, where the page is open anyway, for the next incremental run.
+        fingerprint = page_content_digest(page)
         np_image = np.array(image)
 
         # --- Barcode Detection using pyzbar ---
-        barcode_results = decode(np_image)
-        barcode_boxes = []
-        for barcode in barcode_results:
-            x, y, w, h = barcode.rect
-            barcode_text = barcode.data.decode("utf-8")
-            barcode_box = {
-                "text": f"Barcode ({barcode.type}): {barcode_text}",
-                "x": x,
-                "y": y,
-                "width": w,
-                "height": h,
-                "corners": {
-                    "top_left": (x, y),
-                    "top_right": (x + w, y),
-                    "bottom_left": (x, y + h),
-                    "bottom_right": (x + w, y + h)
-                },
-                "source": "barcode"  # Mark box as coming from barcode detection.
-            }
-            barcode_boxes.append(barcode_box)
-        # -------------------------------------------------------------------
-
-        # Extract overall text using Tesseract.
-        text = pytesseract.image_to_string(np_image, lang='eng')
+        barcode_boxes = detect_barcodes(np_image)
+
+        # Blank out the unchanged template regions so only the variable areas are OCR'd.
+        cached_boxes = []
+        if template_mode:
+            template_key = layout_key("tesseract", image)
+            grey = image.convert("L")
+            cached_boxes = apply_templates(template_key, grey, np_image)
+
+        # Extract overall text using Tesseract (in template mode it is rebuilt from the boxes instead).
+        if not template_mode:
+            text = pytesseract.image_to_string(np_image, lang='eng')
         # Detailed OCR data with bounding boxes.
         data = pytesseract.image_to_data(np_image, lang='eng', output_type=Output.DICT)
         ocr_results = []
@@ -88,428 +429,308 @@ def process_page_tesseractOCR(page_num, pdf_path, pdf_name, render_resolution, j
             bbox = [(left, top), (left + width, top),
                     (left + width, top + height), (left, top + height)]
             ocr_results.append((bbox, word, conf))
-        
-        # Build a word_data list.
-        word_data = []
-        for bbox, word, conf in ocr_results:
-            label = word if (conf >= 45 and word) else "Image/Logo/Symbol/Signature Detected"
-            x1, y1 = bbox[0]
-            x3, y3 = bbox[2]
-            word_data.append({
-                "text": label,
-                "x": int(x1),
-                "y": int(y1),
-                "width": int(x3 - x1),
-                "height": int(y3 - y1)
-            })
-        
-        # Group words into lines.
-        word_data.sort(key=lambda w: (w["y"], w["x"]))
-        line_groups = []
-        line_threshold = 0.1
-        max_horizontal_gap = 19.5
-        current_group = []
-        for wd in word_data:
-            if not current_group:
-                current_group.append(wd)
-            else:
-                avg_y = sum(item["y"] for item in current_group) / len(current_group)
-                last_word = current_group[-1]
-                last_right = last_word["x"] + last_word["width"]
-                horizontal_gap = wd["x"] - last_right
-                if abs(wd["y"] - avg_y) <= line_threshold and horizontal_gap <= max_horizontal_gap:
-                    if is_bullet_or_number(wd["text"]) and is_bullet_or_number(current_group[-1]["text"]):
-                        line_groups.append(current_group)
-                        current_group = [wd]
-                    else:
-                        current_group.append(wd)
-                else:
-                    line_groups.append(current_group)
-                    current_group = [wd]
-        if current_group:
-            line_groups.append(current_group)
-
-        # Helper to add corner points.
-        def add_corner_points(x, y, width, height):
-            return {
-                "top_left": (x, y),
-                "top_right": (x + width, y),
-                "bottom_left": (x, y + height),
-                "bottom_right": (x + width, y + height)
-            }
-
-        # Convert line groups into bounding boxes with corners.
-        grouped_boxes = []
-        for group in line_groups:
-            line_text = " ".join(item["text"] for item in group)
-            min_x = min(item["x"] for item in group)
-            min_y = min(item["y"] for item in group)
-            max_x = max(item["x"] + item["width"] for item in group)
-            max_y = max(item["y"] + item["height"] for item in group)
-            width = max_x - min_x
-            height = max_y - min_y
-            corners = add_corner_points(min_x, min_y, width, height)
-            grouped_boxes.append({
-                "text": line_text,
-                "x": min_x,
-                "y": min_y,
-                "width": width,
-                "height": height,
-                "corners": corners
-            })
-        
-        # Optionally merge boxes that are very close.
-        def boxes_are_close_or_overlap(boxA, boxB, threshold=2, max_horizontal_gap=10, max_vertical_gap=2):
-            A_left = boxA["x"] - threshold
-            A_right = boxA["x"] + boxA["width"] + threshold
-            A_top = boxA["y"] - threshold
-            A_bottom = boxA["y"] + boxA["height"] + threshold
-            B_left = boxB["x"] - threshold
-            B_right = boxB["x"] + boxB["width"] + threshold
-            B_top = boxB["y"] - threshold
-            B_bottom = boxB["y"] + boxB["height"] + threshold
-            horizontal_overlap = not (A_right < B_left or A_left > B_right)
-            vertical_overlap = not (A_bottom < B_top or A_top > B_bottom)
-            if boxA["x"] + boxA["width"] < boxB["x"]:
-                horizontal_gap = boxB["x"] - (boxA["x"] + boxA["width"])
-            elif boxB["x"] + boxB["width"] < boxA["x"]:
-                horizontal_gap = boxA["x"] - (boxB["x"] + boxB["width"])
-            else:
-                horizontal_gap = 0
-            if boxA["y"] + boxA["height"] < boxB["y"]:
-                vertical_gap = boxB["y"] - (boxA["y"] + boxA["height"])
-            elif boxB["y"] + boxB["height"] < boxA["y"]:
-                vertical_gap = boxA["y"] - (boxB["y"] + boxB["height"])
-            else:
-                vertical_gap = 0
-            if horizontal_gap > max_horizontal_gap or vertical_gap > max_vertical_gap:
-                return False
-            return horizontal_overlap and vertical_overlap
-        
-        def merge_two_boxes(boxA, boxB):
-            merged_text = boxA["text"] + " " + boxB["text"]
-            min_x = min(boxA["x"], boxB["x"])
-            min_y = min(boxA["y"], boxB["y"])
-            max_x = max(boxA["x"] + boxA["width"], boxB["x"] + boxB["width"])
-            max_y = max(boxA["y"] + boxA["height"], boxB["y"] + boxB["height"])
-            width = max_x - min_x
-            height = max_y - min_y
-            corners = add_corner_points(min_x, min_y, width, height)
-            return {
-                "text": merged_text,
-                "x": min_x,
-                "y": min_y,
-                "width": width,
-                "height": height,
-                "corners": corners
-            }
-        
-        if not grouped_boxes:
-            grouped_boxes = []
-        merged = True
-        while merged and grouped_boxes:
-            merged = False
-            new_list = []
-            while grouped_boxes:
-                current = grouped_boxes.pop(0)
-                has_merged = False
-                for i, other in enumerate(grouped_boxes):
-                    if boxes_are_close_or_overlap(current, other, threshold=10, max_horizontal_gap=max_horizontal_gap, max_vertical_gap=10):
-                        merged_box = merge_two_boxes(current, other)
-                        new_list.append(merged_box)
-                        grouped_boxes.pop(i)
-                        has_merged = True
-                        merged = True
-                        break
-                if not has_merged:
-                    new_list.append(current)
-            grouped_boxes = new_list
+        del np_image, data
+
+        grouped_boxes = build_grouped_boxes(ocr_results, conf_threshold=45)
+
+        if template_mode:
+            grouped_boxes, text = combine_template_boxes(grouped_boxes, cached_boxes, "\n")
+            learn_templates(template_key, grey, grouped_boxes, f"{pdf_name}#{page_num + 1}")
+            del grey
 
         # Append barcode boxes to OCR-detected boxes.
         grouped_boxes.extend(barcode_boxes)
 
-        # Draw bounding boxes using computed corners.
-        # Use blue for barcode boxes, red for OCR boxes.
-        for box in grouped_boxes:
-            x1, y1 = box["corners"]["top_left"]
-            x2, y2 = box["corners"]["bottom_right"]
-            if x2 < x1:
-                x1, x2 = x2, x1
-            if y2 < y1:
-                y1, y2 = y2, y1
-            # Determine the drawing color.
-            color = "green" if box.get("source") == "barcode" else "blue"
-            draw.rectangle([(x1, y1), (x2, y2)], outline=color, width=4)
-
-        pdf_output_folder = os.path.join(STATIC_FOLDER, pdf_name)
-        os.makedirs(pdf_output_folder, exist_ok=True)
-        output_image_path = os.path.join(pdf_output_folder, f"output_visualized_page_{page_num+1}.png")
-        image.save(output_image_path)
-        
-        if json_mode == "with_text":
-            page_data = {
-                "page": page_num + 1,
-                "boxes": grouped_boxes,
-                "text": text
-            }
-        else:
-            page_data = {
-                "page": page_num + 1,
-                "boxes": [{
-                    "x": box["x"],
-                    "y": box["y"],
-                    "width": box["width"],
-                    "height": box["height"],
-                    "corners": box["corners"]
-                } for box in grouped_boxes]
-            }
-        json_output_path = os.path.join(pdf_output_folder, f"text_extraction_page_{page_num+1}.json")
-        with open(json_output_path, "w") as f:
-            json.dump(page_data, f, indent=4)
-        return page_data
-
-def process_page_easyocr(page_num, pdf_path, pdf_name, render_resolution, json_mode, original_dims):
-    """Process a single PDF page using EasyOCR with integrated barcode detection (pyzbar)."""
+        # Use green for barcode boxes, blue for OCR boxes.
+        return save_page_outputs(page_num, image, pdf_name, json_mode, grouped_boxes, text,
+                                 ocr_color="blue", barcode_color="green", fingerprint=fingerprint)
+
+def process_page_easyocr(page_num, pdf_path, pdf_name, render_resolution, json_mode, original_dims,
+                         template_mode=False):
+    """
+    Process a single PDF page using EasyOCR with integrated barcode detection (pyzbar).
+    With template_mode, regions identical to learned template regions reuse their cached boxes
+    and only the rest of the page is OCR'd (see page_templates.py).
+    """
     print(f"Processing Page {page_num + 1} with EasyOCR...")
     with pdfplumber.open(pdf_path) as pdf:
         page = pdf.pages[page_num]
         image = page.to_image(resolution=render_resolution).original
-        draw = ImageDraw.Draw(image)
+        # Fingerprinted here, where the page is open anyway, for the next incremental run.
+        fingerprint = page_content_digest(page)
         np_image = np.array(image)
 
         # --- Barcode Detection with pyzbar ---
-        from pyzbar.pyzbar import decode  # ensure pyzbar is imported
-        barcode_results = decode(np_image)
-        barcode_boxes = []
-        for barcode in barcode_results:
-            x, y, w, h = barcode.rect
-            barcode_text = barcode.data.decode("utf-8")
-            barcode_box = {
-                "text": f"Barcode ({barcode.type}): {barcode_text}",
-                "x": x,
-                "y": y,
-                "width": w,
-                "height": h,
-                "corners": {
-                    "top_left": (x, y),
-                    "top_right": (x + w, y),
-                    "bottom_left": (x, y + h),
-                    "bottom_right": (x + w, y + h)
-                },
-                "source": "barcode"  # Tag to mark this box as coming from barcode detection.
-            }
-            barcode_boxes.append(barcode_box)
-        # -----------------------------------------------------------------
-
-        # Extract overall text from EasyOCR (detail=0) and detailed OCR data.
-        text_lines = easyocr_reader.readtext(np_image, detail=0)
-        text = " ".join(text_lines)
-        ocr_results = easyocr_reader.readtext(np_image)
-        word_data = []
-        for bbox, word, conf in ocr_results:
-            label = word if (conf >= 0.45 and word) else "Image/Logo/Symbol/Signature Detected"
-            x1, y1 = bbox[0]
-            x3, y3 = bbox[2]
-            word_data.append({
-                "text": label,
-                "x": int(x1),
-                "y": int(y1),
-                "width": int(x3 - x1),
-                "height": int(y3 - y1)
-            })
-
-        # Group words into lines.
-        word_data.sort(key=lambda w: (w["y"], w["x"]))
-        line_groups = []
-        line_threshold = 0.1
-        max_horizontal_gap = 19.5
-        current_group = []
-        for wd in word_data:
-            if not current_group:
-                current_group.append(wd)
-            else:
-                avg_y = sum(item["y"] for item in current_group) / len(current_group)
-                last_word = current_group[-1]
-                last_right = last_word["x"] + last_word["width"]
-                horizontal_gap = wd["x"] - last_right
-                if abs(wd["y"] - avg_y) <= line_threshold and horizontal_gap <= max_horizontal_gap:
-                    if is_bullet_or_number(wd["text"]) and is_bullet_or_number(current_group[-1]["text"]):
-                        line_groups.append(current_group)
-                        current_group = [wd]
-                    else:
-                        current_group.append(wd)
-                else:
-                    line_groups.append(current_group)
-                    current_group = [wd]
-        if current_group:
-            line_groups.append(current_group)
-
-        # Helper to compute corner points.
-        def add_corner_points(x, y, width, height):
-            return {
-                "top_left": (x, y),
-                "top_right": (x + width, y),
-                "bottom_left": (x, y + height),
-                "bottom_right": (x + width, y + height)
-            }
-
-        # Convert line groups into bounding boxes with corners.
-        grouped_boxes = []
-        for group in line_groups:
-            line_text = " ".join(item["text"] for item in group)
-            min_x = min(item["x"] for item in group)
-            min_y = min(item["y"] for item in group)
-            max_x = max(item["x"] + item["width"] for item in group)
-            max_y = max(item["y"] + item["height"] for item in group)
-            width = max_x - min_x
-            height = max_y - min_y
-            corners = add_corner_points(min_x, min_y, width, height)
-            grouped_boxes.append({
-                "text": line_text,
-                "x": min_x,
-                "y": min_y,
-                "width": width,
-                "height": height,
-                "corners": corners
-            })
-
-        # Optionally merge boxes that are very close.
-        def boxes_are_close_or_overlap(boxA, boxB, threshold=2, max_horizontal_gap=10, max_vertical_gap=2):
-            A_left = boxA["x"] - threshold
-            A_right = boxA["x"] + boxA["width"] + threshold
-            A_top = boxA["y"] - threshold
-            A_bottom = boxA["y"] + boxA["height"] + threshold
-            B_left = boxB["x"] - threshold
-            B_right = boxB["x"] + boxB["width"] + threshold
-            B_top = boxB["y"] - threshold
-            B_bottom = boxB["y"] + boxB["height"] + threshold
-            horizontal_overlap = not (A_right < B_left or A_left > B_right)
-            vertical_overlap = not (A_bottom < B_top or A_top > B_bottom)
-            if boxA["x"] + boxA["width"] < boxB["x"]:
-                horizontal_gap = boxB["x"] - (boxA["x"] + boxA["width"])
-            elif boxB["x"] + boxB["width"] < boxA["x"]:
-                horizontal_gap = boxA["x"] - (boxB["x"] + boxB["width"])
-            else:
-                horizontal_gap = 0
-            if boxA["y"] + boxA["height"] < boxB["y"]:
-                vertical_gap = boxB["y"] - (boxA["y"] + boxA["height"])
-            elif boxB["y"] + boxB["height"] < boxA["y"]:
-                vertical_gap = boxA["y"] - (boxB["y"] + boxB["height"])
-            else:
-                vertical_gap = 0
-            if horizontal_gap > max_horizontal_gap or vertical_gap > max_vertical_gap:
-                return False
-            return horizontal_overlap and vertical_overlap
-
-        def merge_two_boxes(boxA, boxB):
-            merged_text = boxA["text"] + " " + boxB["text"]
-            min_x = min(boxA["x"], boxB["x"])
-            min_y = min(boxA["y"], boxB["y"])
-            max_x = max(boxA["x"] + boxA["width"], boxB["x"] + boxB["width"])
-            max_y = max(boxA["y"] + boxA["height"], boxB["y"] + boxB["height"])
-            width = max_x - min_x
-            height = max_y - min_y
-            corners = add_corner_points(min_x, min_y, width, height)
-            return {
-                "text": merged_text,
-                "x": min_x,
-                "y": min_y,
-                "width": width,
-                "height": height,
-                "corners": corners
-            }
-
-        if not grouped_boxes:
-            grouped_boxes = []
-        merged = True
-        while merged and grouped_boxes:
-            merged = False
-            new_list = []
-            while grouped_boxes:
-                current = grouped_boxes.pop(0)
-                has_merged = False
-                for i, other in enumerate(grouped_boxes):
-                    if boxes_are_close_or_overlap(current, other, threshold=10, max_horizontal_gap=max_horizontal_gap, max_vertical_gap=10):
-                        merged_box = merge_two_boxes(current, other)
-                        new_list.append(merged_box)
-                        grouped_boxes.pop(i)
-                        has_merged = True
-                        merged = True
-                        break
-                if not has_merged:
-                    new_list.append(current)
-            grouped_boxes = new_list
+        barcode_boxes = detect_barcodes(np_image)
+
+        # Blank out the unchanged template regions so only the variable areas are OCR'd.
+        cached_boxes = []
+        if template_mode:
+            template_key = layout_key("easyocr", image)
+            grey = image.convert("L")
+            cached_boxes = apply_templates(template_key, grey, np_image)
+
+        # Extract overall text from EasyOCR (detail=0) and detailed OCR data
+        # (in template mode the text is rebuilt from the boxes instead).
+        reader = get_easyocr_reader()
+        if not template_mode:
+            text_lines = reader.readtext(np_image, detail=0)
+            text = " ".join(text_lines)
+        ocr_results = reader.readtext(np_image)
+        del np_image
+
+        grouped_boxes = build_grouped_boxes(ocr_results, conf_threshold=0.45)
+
+        if template_mode:
+            grouped_boxes, text = combine_template_boxes(grouped_boxes, cached_boxes, " ")
+            learn_templates(template_key, grey, grouped_boxes, f"{pdf_name}#{page_num + 1}")
+            del grey
 
         # Append barcode boxes into the final results.
         grouped_boxes.extend(barcode_boxes)
 
-        # Draw bounding boxes.
-        for box in grouped_boxes:
-            x1, y1 = box["corners"]["top_left"]
-            x2, y2 = box["corners"]["bottom_right"]
-            if x2 < x1:
-                x1, x2 = x2, x1
-            if y2 < y1:
-                y1, y2 = y2, y1
-            # Use blue for barcode boxes, red for normal OCR boxes.
-            color = "blue" if box.get("source") == "barcode" else "red"
-            draw.rectangle([(x1, y1), (x2, y2)], outline=color, width=4)
-
-        # Save processed image and JSON output.
-        pdf_output_folder = os.path.join(STATIC_FOLDER, pdf_name)
-        os.makedirs(pdf_output_folder, exist_ok=True)
-        output_image_path = os.path.join(pdf_output_folder, f"output_visualized_page_{page_num+1}.png")
-        image.save(output_image_path)
-
-        if json_mode == "with_text":
-            page_data = {
-                "page": page_num + 1,
-                "boxes": grouped_boxes,
-                "text": text
-            }
-        else:
-            page_data = {
-                "page": page_num + 1,
-                "boxes": [{
-                    "x": box["x"],
-                    "y": box["y"],
-                    "width": box["width"],
-                    "height": box["height"],
-                    "corners": box["corners"]
-                } for box in grouped_boxes]
-            }
-        json_output_path = os.path.join(pdf_output_folder, f"text_extraction_page_{page_num+1}.json")
-        with open(json_output_path, "w") as f:
-            json.dump(page_data, f, indent=4)
-        return page_data
+        # Use blue for barcode boxes, red for normal OCR boxes.
+        return save_page_outputs(page_num, image, pdf_name, json_mode, grouped_boxes, text,
+                                 ocr_color="red", barcode_color="blue", fingerprint=fingerprint)
+
+def process_pages_easyocr_batched(page_nums, pdf_path, pdf_name, render_resolution, json_mode, original_dims,
+                                  template_mode=False):
+    """
+    Process a group of PDF pages using EasyOCR, recognizing the text regions of all
+    pages in large shared batches instead of one readtext call per page.
+    template_mode works as in process_page_easyocr.
+    Returns the list of page data, in page order.
+    """
+    print(f"Processing Pages {page_nums[0] + 1}-{page_nums[-1] + 1} with batched EasyOCR...")
+    # Reader.recognize processes crops one by one on CPU, whatever its batch_size, so the
+    # crops are cut here and passed to EasyOCR's get_text directly in real batches.
+    from easyocr.utils import get_image_list
+    from easyocr.recognition import get_text
+    reader = get_easyocr_reader()
+    pages = []
+    crops = []
+    crop_pages = []
+    with pdfplumber.open(pdf_path) as pdf:
+        for index, page_num in enumerate(page_nums):
+            page = pdf.pages[page_num]
+            image = page.to_image(resolution=render_resolution).original
+            np_image = np.array(image)
+            barcode_boxes = detect_barcodes(np_image)
+            # Blank out the unchanged template regions so only the variable areas are detected.
+            cached_boxes, template_key = [], None
+            if template_mode:
+                template_key = layout_key("easyocr", image)
+                cached_boxes = apply_templates(template_key, image.convert("L"), np_image)
+            # Run detection only; recognition is deferred so it can batch across pages.
+            horizontal_list, free_list = reader.detect(np_image)
+            # Cut the detected regions out of the greyscale page right away, so only the
+            # small crops (not whole greyscale pages) are kept until recognition. The crops come
+            # from the blanked page: detection boxes have margins that may reach into template regions.
+            grey_np = np.array(Image.fromarray(np_image).convert("L"))
+            del np_image
+            page_crops, _ = get_image_list(horizontal_list[0], free_list[0], grey_np,
+                                           model_height=EASYOCR_MODEL_HEIGHT)
+            del grey_np
+            crops.extend(page_crops)
+            crop_pages.extend([index] * len(page_crops))
+            pages.append({
+                "page_num": page_num,
+                "image": image,
+                "barcode_boxes": barcode_boxes,
+                "cached_boxes": cached_boxes,
+                "template_key": template_key,
+                "fingerprint": page_content_digest(page),
+                "ocr_results": []
+            })
+
+    if crops:
+        # Same settings as Reader.recognize's defaults, but with a real batch size.
+        ignore_char = "".join(set(reader.character) - set(reader.lang_char))
+        # Every crop of a get_text call is padded to its width, so recognize the crops by increasing
+        # width, one batch at a time, each padded only to its own widest crop.
+        widths = [math.ceil(crop.shape[1] / crop.shape[0]) * EASYOCR_MODEL_HEIGHT for _, crop in crops]
+        order = sorted(range(len(crops)), key=lambda i: widths[i])
+        recognized = [None] * len(crops)
+        for start in range(0, len(order), EASYOCR_BATCH_SIZE):
+            bucket = order[start:start + EASYOCR_BATCH_SIZE]
+            bucket_results = get_text(reader.character, EASYOCR_MODEL_HEIGHT, widths[bucket[-1]], reader.recognizer,
+                                      reader.converter, [crops[i] for i in bucket], ignore_char, "greedy", 5,
+                                      EASYOCR_BATCH_SIZE, 0.1, 0.5, 0.003, 0, reader.device)
+            # get_text returns one result per crop, in the order given.
+            for i, result in zip(bucket, bucket_results):
+                recognized[i] = result
+        # Route each result back to its page, in detection order.
+        for index, (bbox, word, conf) in zip(crop_pages, recognized):
+            pages[index]["ocr_results"].append((bbox, word, conf))
+    del crops
+
+    results = []
+    for p in pages:
+        text = " ".join(word for _, word, _ in p["ocr_results"])
+        grouped_boxes = build_grouped_boxes(p["ocr_results"], conf_threshold=0.45)
+        if template_mode:
+            grouped_boxes, text = combine_template_boxes(grouped_boxes, p["cached_boxes"], " ")
+            learn_templates(p["template_key"], p["image"].convert("L"), grouped_boxes,
+                            f"{pdf_name}#{p['page_num'] + 1}")
+        grouped_boxes.extend(p["barcode_boxes"])
+        results.append(save_page_outputs(p["page_num"], p["image"], pdf_name, json_mode, grouped_boxes, text,
+                                         ocr_color="red", barcode_color="blue", fingerprint=p["fingerprint"]))
+        p["image"] = None
+    return results
+
+def summarize_page_data(page_data, pdf_name):
+    """Return a small summary of a page's results, pointing at its JSON file on disk."""
+    summary = {
+        "page": page_data["page"],
+        "num_boxes": len(page_data["boxes"]),
+        "json_path": os.path.join(STATIC_FOLDER, pdf_name, f"text_extraction_page_{page_data['page']}.json")
+    }
+    if "fingerprint" in page_data:
+        summary["fingerprint"] = page_data["fingerprint"]
+    return summary
+
+def process_task_summarized(args):
+    """
+    Run process_page_func on a page (or group of pages) and return only the page summaries,
+    so the full boxes and text stay on disk instead of being sent back to the parent process.
+    """
+    process_page_func, task, pdf_path, pdf_name, render_resolution, json_mode, original_dims, template_mode = args
+    page_data = process_page_func(task, pdf_path, pdf_name, render_resolution, json_mode, original_dims,
+                                  template_mode)
+    if isinstance(page_data, list):
+        return [summarize_page_data(data, pdf_name) for data in page_data]
+    return [summarize_page_data(page_data, pdf_name)]
 
 ###############################################################################
 # Combined OCR Processing Function
 ###############################################################################
-def extract_text_and_convert_to_json(pdf_path, render_resolution, json_mode, original_dims, ocr_engine):
+def extract_text_and_convert_to_json(pdf_path, render_resolution, json_mode, original_dims, ocr_engine,
+                                     incremental=False, memory_bounded=False, template_mode=False,
+                                     pdf_name=None, previous_pdf_name=None):
+    """
+    OCR every page of the PDF into STATIC_FOLDER/<pdf_name>/ (pdf_name defaults to the PDF's file name).
+    With incremental=True, pages whose fingerprint (content + settings) matches the previous run
+    (in STATIC_FOLDER/<previous_pdf_name>/, by default the same folder) reuse its saved image
+    and JSON and are not OCR'd again.
+    With memory_bounded=True (forced for documents of MEMORY_BOUNDED_MIN_PAGES pages or more),
+    at most MAX_INFLIGHT_PAGES pages are processed at once and results holds only
+    per-page summaries; the full page data is streamed to the page JSON files.
+    With template_mode=True, regions learned from previous pages of the same layout that are
+    pixel-identical reuse their cached boxes and only the variable areas are OCR'd.
+    Returns (results, execution_time, num_pages, reused_pages).
+    """
     start_time = time.time()
-    pdf_name = os.path.basename(pdf_path).replace(".pdf", "")
+    pdf_name = pdf_name or os.path.basename(pdf_path).replace(".pdf", "")
     pdf_output_folder = os.path.join(STATIC_FOLDER, pdf_name)
-    if os.path.exists(pdf_output_folder):
-        for f in os.listdir(pdf_output_folder):
-            os.remove(os.path.join(pdf_output_folder, f))
-    else:
-        os.makedirs(pdf_output_folder, exist_ok=True)
+    previous_folder = os.path.join(STATIC_FOLDER, previous_pdf_name or pdf_name)
+    previous_fingerprints = load_manifest(previous_folder) if incremental else {}
+    os.makedirs(pdf_output_folder, exist_ok=True)
+
+    settings = {"render_resolution": render_resolution, "json_mode": json_mode, "ocr_engine": ocr_engine,
+                "template_mode": template_mode}
     with pdfplumber.open(pdf_path) as pdf:
         num_pages = len(pdf.pages)
-    
+        # Only an incremental run needs every fingerprint up front, to pick the pages to reuse.
+        # Otherwise each worker fingerprints the page it opens, so the server process never
+        # has to load (and cache) the whole document.
+        fingerprints = {}
+        if incremental:
+            fingerprints = {i + 1: page_fingerprint(page, settings) for i, page in enumerate(pdf.pages)}
+    memory_bounded = memory_bounded or num_pages >= MEMORY_BOUNDED_MIN_PAGES
+
+    reused_pages = []
+    for page, fingerprint in fingerprints.items():
+        if (previous_fingerprints.get(page) == fingerprint
+                and os.path.exists(os.path.join(previous_folder, f"output_visualized_page_{page}.png"))
+                and os.path.exists(os.path.join(previous_folder, f"text_extraction_page_{page}.json"))):
+            reused_pages.append(page)
+    pages_to_process = [i for i in range(num_pages) if i + 1 not in reused_pages]
+
+    # Remove everything except the outputs of the reused pages, copying them over from the previous run's folder.
+    keep = {f"output_visualized_page_{page}.png" for page in reused_pages}
+    keep |= {f"text_extraction_page_{page}.json" for page in reused_pages}
+    same_folder = os.path.abspath(previous_folder) == os.path.abspath(pdf_output_folder)
+    for f in os.listdir(pdf_output_folder):
+        if f not in keep or not same_folder:
+            os.remove(os.path.join(pdf_output_folder, f))
+    if not same_folder:
+        for f in keep:
+            shutil.copy2(os.path.join(previous_folder, f), os.path.join(pdf_output_folder, f))
+    if reused_pages:
+        print(f"Reusing unchanged page(s): {reused_pages}")
+
     if ocr_engine == "tesseract":
         process_page_func = process_page_tesseractOCR
+        page_tasks = pages_to_process
+    elif ocr_engine == "easyocr_batched":
+        # Each task is a group of pages recognized together in one process.
+        process_page_func = process_pages_easyocr_batched
+        pages_per_task = EASYOCR_PAGES_PER_BATCH
+        if memory_bounded:
+            pages_per_task = max(min(pages_per_task, MAX_INFLIGHT_PAGES), 1)
+        page_tasks = [pages_to_process[i:i + pages_per_task]
+                      for i in range(0, len(pages_to_process), pages_per_task)]
     else:
         process_page_func = process_page_easyocr
-
-    with Pool(max(cpu_count() - 1, 1)) as pool:
-        results = pool.starmap(
-            process_page_func,
-            [(i, pdf_path, pdf_name, render_resolution, json_mode, original_dims) for i in range(num_pages)]
-        )
+        page_tasks = pages_to_process
+
+    results = []
+    if page_tasks:
+        # Size this job from the task count and the CPUs actually available (cgroup aware),
+        # capping each worker's OpenMP/torch threads so the workers don't oversubscribe the cores.
+        # Batched EasyOCR uses a few workers (model copies) with more torch threads each instead.
+        max_workers = EASYOCR_BATCHED_MAX_WORKERS if ocr_engine == "easyocr_batched" else None
+        if memory_bounded:
+            pages_per_task = len(page_tasks[0]) if isinstance(page_tasks[0], list) else 1
+            max_tasks_inflight = max(MAX_INFLIGHT_PAGES // pages_per_task, 1)
+            num_workers, threads_per_worker = plan_workers(min(len(page_tasks), max_tasks_inflight), max_workers)
+            print(f"Memory-bounded mode: using {num_workers} worker(s) with {threads_per_worker} thread(s) each.")
+            # Only page summaries come back; the full page data stays in the page JSON files.
+            tasks = [(threads_per_worker, process_task_summarized,
+                      ((process_page_func, task, pdf_path, pdf_name, render_resolution,
+                        json_mode, original_dims, template_mode),)) for task in page_tasks]
+        else:
+            num_workers, threads_per_worker = plan_workers(len(page_tasks), max_workers)
+            print(f"Using {num_workers} worker(s) with {threads_per_worker} thread(s) each.")
+            tasks = [(threads_per_worker, process_page_func,
+                      (task, pdf_path, pdf_name, render_resolution, json_mode, original_dims, template_mode))
+                     for task in page_tasks]
+
+        def collect(outputs):
+            # Consume the outputs as they arrive; groups of pages come back as lists.
+            for output in outputs:
+                results.extend(output if isinstance(output, list) else [output])
+
+        shared_pool = ocr_pool(ocr_engine)
+        if shared_pool is not None:
+            # The server's pool is shared by all jobs: this job keeps at most num_workers tasks on it.
+            collect(imap_bounded(shared_pool, run_with_thread_limit, tasks, num_workers))
+        else:
+            # In memory-bounded mode, recycle workers periodically so memory fragmented by PIL/torch is given back.
+            tasks_per_child = MEMORY_BOUNDED_TASKS_PER_CHILD if memory_bounded else None
+            with pool_context().Pool(num_workers, maxtasksperchild=tasks_per_child) as pool:
+                collect(pool.imap_unordered(run_with_thread_limit, tasks))
+
+    for page in reused_pages:
+        with open(os.path.join(pdf_output_folder, f"text_extraction_page_{page}.json"), "r") as f:
+            page_data = json.load(f)
+        results.append(summarize_page_data(page_data, pdf_name) if memory_bounded else page_data)
+    results.sort(key=lambda page_data: page_data["page"])
+    for page_data in results:
+        content = page_data.pop("fingerprint", None)
+        if content is not None:
+            fingerprints.setdefault(page_data["page"], settings_fingerprint(content, settings))
+
+    # Save the fingerprints so the next (incremental) run can reuse unchanged pages.
+    save_manifest(pdf_output_folder, fingerprints)
+    if memory_bounded:
+        # Only summaries are in memory: the index is built from the page JSON files on the first query.
+        drop_document_index(pdf_name)
+    else:
+        # Index the boxes now so the query endpoints don't have to parse the page JSON files per request.
+        index_page_results(pdf_name, results)
     execution_time = time.time() - start_time
-    return results, execution_time, num_pages
+    return results, execution_time, num_pages, reused_pages
 
 ###############################################################################
 # Image to PDF Conversion Utility
@@ -527,6 +748,10 @@ def image_to_pdf_file(input_path, output_pdf_path, conversion_resolution):
 ###############################################################################
 # Flask Routes
 ###############################################################################
+def parse_flag(value):
+    """Return True for the usual truthy query/form values ("1", "true", "on", "yes")."""
+    return (value or "").lower() in ("1", "true", "on", "yes")
+
 @app.route('/')
 def upload_form():
     return render_template('upload.html')
@@ -543,6 +768,12 @@ def upload_file():
     doc_type = request.form.get('doc_type')
     json_mode = request.form.get('json_mode')
     ocr_engine = request.form.get('ocr_engine', 'easyocr').lower()  # default to easyocr
+    # Reuse the outputs of pages that are unchanged since the previous upload of this file.
+    incremental = parse_flag(request.form.get('incremental'))
+    # Bound memory use for very large documents (also enabled automatically above MEMORY_BOUNDED_MIN_PAGES).
+    memory_bounded = parse_flag(request.form.get('memory_bounded'))
+    # Reuse the OCR boxes of unchanged template regions (headers, logos, boilerplate) of forms.
+    template_mode = parse_flag(request.form.get('template_mode'))
 
     # Set default resolutions based on OCR engine and document type.
     if ocr_engine == "tesseract":
@@ -578,63 +809,94 @@ def upload_file():
             conversion_resolution = 100
             render_resolution = 300
 
-    filename = file.filename
+    filename = secure_filename(file.filename)
+    if not filename:
+        return jsonify({"error": "Invalid file name"}), 400
     file_ext = os.path.splitext(filename)[1].lower()
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
-    file.save(filepath)
-    original_filepath = filepath
+    # Every upload is a separate job: its upload folder and its output folder (static/<job_id>/)
+    # are keyed by a random job id, so concurrent uploads of the same file name never share files.
+    job_id = f"{os.path.splitext(filename)[0]}_{uuid.uuid4().hex}"
+    upload_folder = os.path.join(UPLOAD_FOLDER, job_id)
+    os.makedirs(upload_folder, exist_ok=True)
+    try:
+        filepath = os.path.join(upload_folder, filename)
+        file.save(filepath)
+        original_filepath = filepath
 
-    original_dims = None
-    if file_ext not in [".pdf"]:
+        original_dims = None
+        if file_ext not in [".pdf"]:
+            try:
+                orig_img = Image.open(filepath)
+                original_dims = orig_img.size
+            except Exception as e:
+                print("Error reading original image dimensions:", e)
+            pdf_filename = os.path.splitext(filename)[0] + ".pdf"
+            pdf_file_path = os.path.join(upload_folder, pdf_filename)
+            converted = image_to_pdf_file(filepath, pdf_file_path, conversion_resolution)
+            if not converted:
+                return jsonify({"error": "Image to PDF conversion failed"}), 500
+            filepath = pdf_file_path
+
+        # An incremental upload reuses the unchanged pages of the latest job for the same file name
+        # (pages are only reused when their content and settings fingerprints match).
+        previous_job_id = load_job_history(filename).get("job_id") if incremental else None
+
+        # Bound the number of OCR jobs running at once; they share the OCR pool's CPUs (see workers.py).
+        if not ocr_job_slots.acquire(timeout=JOB_QUEUE_TIMEOUT):
+            return jsonify({"error": "Server is busy, please try again later"}), 503
         try:
-            orig_img = Image.open(filepath)
-            original_dims = orig_img.size
-        except Exception as e:
-            print("Error reading original image dimensions:", e)
-        pdf_filename = os.path.splitext(filename)[0] + ".pdf"
-        pdf_file_path = os.path.join(UPLOAD_FOLDER, pdf_filename)
-        converted = image_to_pdf_file(filepath, pdf_file_path, conversion_resolution)
-        if not converted:
-            return jsonify({"error": "Image to PDF conversion failed"}), 500
-        filepath = pdf_file_path
-        filename = pdf_filename
-
-    results, execution_time, num_pages = extract_text_and_convert_to_json(filepath, render_resolution, json_mode, original_dims, ocr_engine)
-    pdf_name = os.path.basename(filepath).replace(".pdf", "")
-    pdf_output_folder = os.path.join(STATIC_FOLDER, pdf_name)
-    output_image_path = os.path.join(pdf_output_folder, "output_visualized_page_1.png")
-    json_output_path = os.path.join(pdf_output_folder, "text_extraction_page_1.json")
-
-    original_filepath_abs = os.path.abspath(original_filepath)
-    processed_image_path_abs = os.path.abspath(output_image_path)
-    processed_json_path_abs = os.path.abspath(json_output_path)
-
-    print("Original uploaded file path:", original_filepath_abs)
-    print("Processed image file path:", processed_image_path_abs)
-    print("Processed JSON file path:", processed_json_path_abs)
-    print(f"Execution Time: {execution_time:.2f} seconds")
-
-    paths_data = {
-        "original_image_path": original_filepath_abs,
-        "processed_image_path": processed_image_path_abs,
-        "processed_json_path": processed_json_path_abs
-    }
-    with open("last_paths.json", "w") as f:
-        json.dump(paths_data, f, indent=4)
-
-    redirect_url = f"/results/{pdf_name}"
-    return jsonify({
-        "status": "success",
-        "redirect": redirect_url,
-        "execution_time": f"{execution_time:.2f}"
-    })
+            results, execution_time, num_pages, reused_pages = extract_text_and_convert_to_json(
+                filepath, render_resolution, json_mode, original_dims, ocr_engine,
+                incremental=incremental, memory_bounded=memory_bounded, template_mode=template_mode,
+                pdf_name=job_id, previous_pdf_name=previous_job_id)
+        finally:
+            ocr_job_slots.release()
+        pdf_output_folder = os.path.join(STATIC_FOLDER, job_id)
+        # Keep the original file next to the outputs (for coordinates.py); the upload folder is deleted.
+        original_copy_path = os.path.join(pdf_output_folder, f"original_{filename}")
+        shutil.move(original_filepath, original_copy_path)
+        output_image_path = os.path.join(pdf_output_folder, "output_visualized_page_1.png")
+        json_output_path = os.path.join(pdf_output_folder, "text_extraction_page_1.json")
+
+        original_filepath_abs = os.path.abspath(original_copy_path)
+        processed_image_path_abs = os.path.abspath(output_image_path)
+        processed_json_path_abs = os.path.abspath(json_output_path)
+
+        print("Original uploaded file path:", original_filepath_abs)
+        print("Processed image file path:", processed_image_path_abs)
+        print("Processed JSON file path:", processed_json_path_abs)
+        print(f"Execution Time: {execution_time:.2f} seconds")
+
+        paths_data = {
+            "original_image_path": original_filepath_abs,
+            "processed_image_path": processed_image_path_abs,
+            "processed_json_path": processed_json_path_abs
+        }
+        # Per-job copy for coordinates.py (python3 coordinates.py static/<job_id>/last_paths.json),
+        # plus the shared copy of the most recent upload, both written atomically.
+        write_json_atomic(os.path.join(pdf_output_folder, "last_paths.json"), paths_data)
+        write_json_atomic("last_paths.json", paths_data)
+        record_job(filename, job_id)
+
+        redirect_url = f"/results/{job_id}"
+        return jsonify({
+            "status": "success",
+            "job_id": job_id,
+            "redirect": redirect_url,
+            "execution_time": f"{execution_time:.2f}",
+            "reused_pages": reused_pages
+        })
+    finally:
+        # The upload folder only holds the job's inputs (and the converted PDF).
+        shutil.rmtree(upload_folder, ignore_errors=True)
 
 @app.route('/results/<pdf_name>')
 def display_results(pdf_name):
     pdf_output_folder = os.path.join(STATIC_FOLDER, pdf_name)
     if not os.path.exists(pdf_output_folder):
         return jsonify({"error": "PDF results not found"}), 404
-    num_pages = sum(1 for f in os.listdir(pdf_output_folder) if f.endswith(".png"))
+    num_pages = sum(1 for f in os.listdir(pdf_output_folder)
+                    if f.startswith("output_visualized_page_") and f.endswith(".png"))
     return render_template('results.html', num_pages=num_pages, pdf_name=pdf_name)
 
 @app.route('/json_data/<pdf_name>/<int:page>')
@@ -647,6 +909,66 @@ def get_json_data(pdf_name, page):
         return jsonify({"error": "JSON file not found"}), 404
     return send_file(json_output_path, mimetype='application/json')
 
+@app.route('/query/<pdf_name>/<int:page>/rect')
+def query_boxes_in_rect(pdf_name, page):
+    """Boxes of a page intersecting (or, with contained=1, inside) the rectangle x, y, width, height."""
+    index = get_document_index(pdf_name, os.path.join(STATIC_FOLDER, pdf_name))
+    if index is None:
+        return jsonify({"error": "PDF not found"}), 404
+    try:
+        x = float(request.args["x"])
+        y = float(request.args["y"])
+        width = float(request.args["width"])
+        height = float(request.args["height"])
+    except (KeyError, ValueError):
+        return jsonify({"error": "x, y, width and height are required numbers"}), 400
+    if not all(math.isfinite(value) for value in (x, y, width, height)):
+        return jsonify({"error": "x, y, width and height must be finite numbers"}), 400
+    boxes = index.boxes_in_rect(page, x, y, width, height, contained=parse_flag(request.args.get("contained")))
+    return jsonify({"boxes": boxes})
+
+@app.route('/query/<pdf_name>/search')
+def query_boxes_by_text(pdf_name):
+    """Boxes whose text contains q (case-insensitive), or matches it as a regex with regex=1."""
+    index = get_document_index(pdf_name, os.path.join(STATIC_FOLDER, pdf_name))
+    if index is None:
+        return jsonify({"error": "PDF not found"}), 404
+    query = request.args.get("q")
+    if not query:
+        return jsonify({"error": "q is required"}), 400
+    try:
+        boxes = index.search(query, regex=parse_flag(request.args.get("regex")),
+                             page_num=request.args.get("page", type=int))
+    except re.error as e:
+        return jsonify({"error": f"Invalid regex: {e}"}), 400
+    return jsonify({"boxes": boxes})
+
+@app.route('/query/<pdf_name>/near')
+def query_text_near_anchor(pdf_name):
+    """Boxes within max_distance pixels of each box matching anchor (direction: any, right or below)."""
+    index = get_document_index(pdf_name, os.path.join(STATIC_FOLDER, pdf_name))
+    if index is None:
+        return jsonify({"error": "PDF not found"}), 404
+    anchor = request.args.get("anchor")
+    if not anchor:
+        return jsonify({"error": "anchor is required"}), 400
+    max_distance = request.args.get("max_distance", 100, type=float)
+    if not math.isfinite(max_distance) or max_distance < 0:
+        return jsonify({"error": "max_distance must be a finite, non-negative number"}), 400
+    direction = request.args.get("direction", "any")
+    if direction not in ("any", "right", "below"):
+        return jsonify({"error": "direction must be any, right or below"}), 400
+    try:
+        matches = index.near(anchor,
+                             max_distance=max_distance,
+                             direction=direction,
+                             regex=parse_flag(request.args.get("regex")),
+                             page_num=request.args.get("page", type=int),
+                             limit=request.args.get("limit", 10, type=int))
+    except re.error as e:
+        return jsonify({"error": f"Invalid regex: {e}"}), 400
+    return jsonify({"matches": matches})
+
 @app.route('/templates/<path:filename>')
 def send_template_file(filename):
     return send_from_directory('templates', filename)
@@ -662,5 +984,30 @@ def get_highlighted_image(pdf_name, page):
     return send_file(image_path, mimetype='image/png')
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    parser = argparse.ArgumentParser(description="Document Layout Analysis OCR server.")
+    parser.add_argument("--production", action="store_true",
+                        help="Serve with the waitress WSGI server instead of the Flask debug server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8,
+                        help="Request threads in production mode (OCR jobs are further capped by OCR_MAX_CONCURRENT_JOBS).")
+    parser.add_argument("--preload-easyocr", action="store_true",
+                        help="Load the model in the batched EasyOCR workers at startup, not on their first page.")
+    args = parser.parse_args()
+    # Start the OCR pool once, before serving any request. With the debug reloader, only in the
+    # process that actually serves (WERKZEUG_RUN_MAIN), not in the file watcher.
+    if args.production or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        preload_easyocr = args.preload_easyocr
+        enable_shared_pools()
+        ocr_pool("tesseract")
+        if preload_easyocr:
+            ocr_pool("easyocr_batched")
+    if args.production:
+        try:
+            from waitress import serve
+        except ImportError:
+            sys.exit("Production mode requires waitress: pip install waitress")
+        serve(app, host=args.host, port=args.port, threads=args.threads)
+    else:
+        app.run(host=args.host, port=args.port, debug=True)
     
\ No newline at end of file
@@ -0,0 +1,85 @@
+# load_test.py
+import os
+import sys
+import math
+import time
+import uuid
+import json
+import argparse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+def build_multipart(fields, file_field, filename, file_bytes):
+    """Encode form fields and one file as a multipart/form-data body."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode())
+    parts.append(f"--{boundary}\r\nContent-Disposition: form-data; name=\"{file_field}\"; filename=\"{filename}\"\r\n"
+                 f"Content-Type: application/octet-stream\r\n\r\n".encode())
+    parts.append(file_bytes)
+    parts.append(f"\r\n--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def upload_once(url, fields, filename, file_bytes, timeout):
+    """Upload the file once; returns (latency_seconds, ok, detail)."""
+    body, content_type = build_multipart(fields, "file", filename, file_bytes)
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": content_type}, method="POST")
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            data = json.loads(resp.read())
+        ok = data.get("status") == "success"
+        detail = data.get("error", "")
+    except Exception as e:
+        ok, detail = False, str(e)
+    return time.perf_counter() - start, ok, detail
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent upload load test for the OCR server.")
+    parser.add_argument("file", help="PDF or image to upload")
+    parser.add_argument("--url", default="http://127.0.0.1:5000/upload")
+    parser.add_argument("--requests", type=int, default=20, help="Total number of uploads")
+    parser.add_argument("--concurrency", type=int, default=4, help="Uploads in flight at the same time")
+    parser.add_argument("--ocr-engine", default="tesseract", choices=["tesseract", "easyocr", "easyocr_batched"])
+    parser.add_argument("--doc-type", default="small", choices=["small", "large"])
+    parser.add_argument("--json-mode", default="with_text", choices=["with_text", "without_text"])
+    parser.add_argument("--same-name", action="store_true",
+                        help="Upload every request under the same file name (each upload is still a separate job)")
+    parser.add_argument("--timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    with open(args.file, "rb") as f:
+        file_bytes = f.read()
+    base, ext = os.path.splitext(os.path.basename(args.file))
+    fields = {"doc_type": args.doc_type, "json_mode": args.json_mode, "ocr_engine": args.ocr_engine}
+
+    def run(i):
+        filename = f"{base}{ext}" if args.same_name else f"{base}_loadtest_{i}{ext}"
+        return upload_once(args.url, fields, filename, file_bytes, args.timeout)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        outcomes = list(executor.map(run, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, ok, _ in outcomes if ok)
+    errors = [detail for _, ok, detail in outcomes if not ok]
+    print(f"Requests: {args.requests}, concurrency: {args.concurrency}, engine: {args.ocr_engine}")
+    print(f"Succeeded: {len(latencies)}, failed: {len(errors)}")
+    print(f"Wall time: {elapsed:.2f} s, throughput: {len(latencies) / elapsed:.3f} requests/s")
+    print(f"Latency p50: {percentile(latencies, 50):.2f} s, p95: {percentile(latencies, 95):.2f} s, "
+          f"p99: {percentile(latencies, 99):.2f} s")
+    for detail in sorted(set(errors)):
+        print("Error:", detail)
+    return 0 if not errors else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+# page_cache.py
+import os
+import json
+import hashlib
+from pdfminer.pdftypes import resolve1, PDFStream, PDFObjRef
+
+MANIFEST_FILENAME = "manifest.json"
+
+def _stream_bytes(obj):
+    """Returns the raw (undecoded) bytes of a PDF stream object, or b"" if obj isn't a stream."""
+    obj = resolve1(obj)
+    if not isinstance(obj, PDFStream):
+        return b""
+    data = obj.get_rawdata()
+    if data is None:
+        data = obj.get_data()
+    return data
+
+def _hash_object(digest, obj, seen):
+    """
+    Feed a PDF object into digest, following references, dictionaries, arrays and
+    streams (including their own /Resources), so nested Form XObjects, images,
+    fonts and graphics states all contribute. Each referenced object is hashed once.
+    """
+    if isinstance(obj, PDFObjRef):
+        if obj.objid in seen:
+            digest.update(f"ref {obj.objid}".encode())
+            return
+        seen.add(obj.objid)
+        obj = resolve1(obj)
+    if isinstance(obj, PDFStream):
+        _hash_object(digest, obj.attrs, seen)
+        digest.update(_stream_bytes(obj))
+    elif isinstance(obj, dict):
+        for key in sorted(obj, key=str):
+            if key in ("Parent", "P"):  # Back-references into the page tree / to the page, not content.
+                continue
+            digest.update(str(key).encode())
+            _hash_object(digest, obj[key], seen)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            _hash_object(digest, item, seen)
+    else:
+        digest.update(repr(obj).encode())
+
+def page_content_fingerprint(page):
+    """
+    Fingerprints a pdfplumber page from its page dictionary: its content streams, annotations
+    (including form field appearance streams), boxes, and everything its resources reference
+    (images, Form XObjects and their own resources, fonts, graphics states...),
+    together with its size, rotation and (possibly inherited) resources.
+    """
+    page_obj = page.page_obj
+    digest = hashlib.sha256()
+    digest.update(repr((page.width, page.height, page.rotation)).encode())
+    seen = set()
+    _hash_object(digest, page_obj.attrs, seen)
+    _hash_object(digest, page_obj.resources or {}, seen)
+    return digest.hexdigest()
+
+def page_pixel_fingerprint(page, resolution=50):
+    """Fingerprints a pdfplumber page from a low resolution rendering of it."""
+    image = page.to_image(resolution=resolution).original
+    digest = hashlib.sha256()
+    digest.update(repr(image.size).encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+def page_content_digest(page):
+    """
+    Returns the content fingerprint of a page, falling back to the rendered pixels
+    if the content streams can't be read.
+    """
+    try:
+        return page_content_fingerprint(page)
+    except Exception as e:
+        print(f"Falling back to pixel fingerprint for page {page.page_number}:", e)
+        return page_pixel_fingerprint(page)
+
+def settings_fingerprint(content, settings):
+    """
+    Combines a page's content fingerprint with the processing settings,
+    so a page is only reused when both its content and the settings are unchanged.
+    """
+    return hashlib.sha256(f"{content}|{json.dumps(settings, sort_keys=True)}".encode()).hexdigest()
+
+def page_fingerprint(page, settings):
+    """Returns the fingerprint of a page's content combined with the processing settings."""
+    return settings_fingerprint(page_content_digest(page), settings)
+
+def load_manifest(pdf_output_folder):
+    """Returns the page fingerprints saved by the previous run ({page_number: fingerprint})."""
+    manifest_path = os.path.join(pdf_output_folder, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, "r") as f:
+            return {int(page): fp for page, fp in json.load(f).get("pages", {}).items()}
+    except (OSError, ValueError) as e:
+        print("Ignoring unreadable page manifest:", e)
+        return {}
+
+def save_manifest(pdf_output_folder, fingerprints):
+    """Saves the page fingerprints ({page_number: fingerprint}) of the current run."""
+    manifest_path = os.path.join(pdf_output_folder, MANIFEST_FILENAME)
+    with open(manifest_path, "w") as f:
+        json.dump({"pages": {str(page): fp for page, fp in sorted(fingerprints.items())}}, f, indent=4)
@@ -0,0 +1,186 @@
+# page_templates.py
+import os
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from PIL import Image
+
+try:
+    import fcntl  # Used to lock a layout's store file across worker processes (not on Windows).
+except ImportError:
+    fcntl = None
+
+# Folder holding the learned template regions, one JSON file per layout (OCR engine + page size + page hash).
+TEMPLATE_FOLDER = "template_cache"
+# A region is reused once the same content has been seen on this many pages (any documents).
+TEMPLATE_MIN_HITS = int(os.environ.get("TEMPLATE_MIN_HITS", "2"))
+# Maximum perceptual hash (dHash) distance for two crops to count as the same region.
+TEMPLATE_PHASH_MAX_DISTANCE = int(os.environ.get("TEMPLATE_PHASH_MAX_DISTANCE", "4"))
+# Maximum distance between the (128-bit) hashes of two whole pages for them to share a layout.
+TEMPLATE_LAYOUT_MAX_DISTANCE = int(os.environ.get("TEMPLATE_LAYOUT_MAX_DISTANCE", "16"))
+# Maximum position difference (pixels) between two observations of the same region.
+TEMPLATE_POSITION_TOLERANCE = 3
+# Regions kept per layout; the least recently seen ones are dropped first.
+TEMPLATE_MAX_REGIONS = 1000
+# Layouts kept in TEMPLATE_FOLDER; the least recently used ones are deleted first.
+TEMPLATE_MAX_LAYOUTS = int(os.environ.get("TEMPLATE_MAX_LAYOUTS", "200"))
+# Index of the known layouts ({key: {"last_used": timestamp}}), so pages don't list the whole folder.
+LAYOUT_INDEX_FILENAME = "layouts.json"
+
+_store_lock = threading.Lock()
+
+def layout_key(ocr_engine, image):
+    """
+    Key of the template store used for a page: the OCR engine, the page size and a coarse
+    perceptual hash of the whole page, so different forms of the same size don't share a store.
+    A page uses the known layout whose hash is closest to its own (within TEMPLATE_LAYOUT_MAX_DISTANCE),
+    so filling in a form doesn't move it to a new layout. Beyond TEMPLATE_MAX_LAYOUTS layouts,
+    the least recently used ones are deleted.
+    """
+    width, height = image.size
+    prefix = f"{ocr_engine}_{width}x{height}_"
+    grey = image.convert("L")
+    # Horizontal and vertical gradients, so full-width bands (headers, footers) count too.
+    page_hash = dhash(grey) + dhash(grey.transpose(Image.TRANSPOSE))
+    key, best_distance = f"{prefix}{page_hash}", TEMPLATE_LAYOUT_MAX_DISTANCE + 1
+    with _locked_json(os.path.join(TEMPLATE_FOLDER, LAYOUT_INDEX_FILENAME)) as index:
+        layouts = index.setdefault("layouts", {})
+        for known_key in layouts:
+            if not known_key.startswith(prefix):
+                continue
+            try:
+                distance = hamming_distance(known_key[len(prefix):], page_hash)
+            except ValueError:
+                continue
+            if distance < best_distance:
+                key, best_distance = known_key, distance
+        layouts[key] = {"last_used": time.time()}
+        if len(layouts) > TEMPLATE_MAX_LAYOUTS:
+            stale = sorted(layouts, key=lambda known_key: layouts[known_key]["last_used"])
+            for stale_key in stale[:len(layouts) - TEMPLATE_MAX_LAYOUTS]:
+                del layouts[stale_key]
+                for suffix in (".json", ".json.lock"):
+                    try:
+                        os.remove(os.path.join(TEMPLATE_FOLDER, f"{stale_key}{suffix}"))
+                    except OSError:
+                        pass
+    return key
+
+def dhash(crop):
+    """64-bit difference hash of a greyscale crop, as a hex string."""
+    small = crop.resize((9, 8), Image.BILINEAR)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+def hamming_distance(hashA, hashB):
+    return bin(int(hashA, 16) ^ int(hashB, 16)).count("1")
+
+def _crop(grey, box):
+    x, y = int(box["x"]), int(box["y"])
+    return grey.crop((x, y, x + max(int(box["width"]), 1), y + max(int(box["height"]), 1)))
+
+def region_hashes(grey, box):
+    """Return (perceptual hash, exact pixel hash) of the region of box in the greyscale page."""
+    crop = _crop(grey, box)
+    return dhash(crop), hashlib.sha1(crop.tobytes()).hexdigest()
+
+@contextmanager
+def _locked_json(path):
+    """Yield the JSON data of a template file for reading/updating under a lock, and save it back afterwards."""
+    os.makedirs(TEMPLATE_FOLDER, exist_ok=True)
+    with _store_lock, open(f"{path}.lock", "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            data = _load_json(path)
+            yield data
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+@contextmanager
+def _locked_store(key):
+    """Yield the regions of a layout for reading/updating, and save them back afterwards."""
+    with _locked_json(os.path.join(TEMPLATE_FOLDER, f"{key}.json")) as store:
+        yield store.setdefault("regions", [])
+
+def _load_json(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print("Ignoring unreadable template file:", e)
+        return {}
+
+def load_regions(key):
+    """Return the learned regions of a layout (empty if nothing was learned yet)."""
+    return _load_json(os.path.join(TEMPLATE_FOLDER, f"{key}.json")).get("regions", [])
+
+def apply_templates(key, grey, np_image):
+    """
+    Look for the stable regions of the layout on the page. Every region whose pixels are
+    identical to the learned ones is blanked out in np_image (so it isn't OCR'd again)
+    and its cached boxes are returned.
+    """
+    cached_boxes = []
+    for region in load_regions(key):
+        if region["hits"] < TEMPLATE_MIN_HITS:
+            continue
+        _, sha = region_hashes(grey, region)
+        if sha != region["sha"]:
+            continue
+        x, y = int(region["x"]), int(region["y"])
+        np_image[y:y + int(region["height"]), x:x + int(region["width"])] = 255
+        cached_boxes.append(dict(region["box"], corners={k: tuple(v) for k, v in region["box"]["corners"].items()}))
+    return cached_boxes
+
+def learn_templates(key, grey, boxes, page_id):
+    """
+    Record the OCR'd boxes of a page (page_id identifies the document and page).
+    A region seen again at the same position with a perceptually identical crop gains a hit;
+    its stored pixels and boxes are refreshed to the latest observation. When the layout has more
+    than TEMPLATE_MAX_REGIONS regions, the least recently seen are dropped, so regions that stopped
+    appearing age out while new ones get the chance to be seen again.
+    """
+    observations = []
+    for box in boxes:
+        if box.get("source") == "barcode" or box["width"] <= 0 or box["height"] <= 0:
+            continue
+        phash, sha = region_hashes(grey, box)
+        observations.append((box, phash, sha))
+    if not observations:
+        return
+    now = time.time()
+    with _locked_store(key) as regions:
+        for box, phash, sha in observations:
+            for region in regions:
+                if (abs(region["x"] - box["x"]) <= TEMPLATE_POSITION_TOLERANCE
+                        and abs(region["y"] - box["y"]) <= TEMPLATE_POSITION_TOLERANCE
+                        and abs(region["width"] - box["width"]) <= TEMPLATE_POSITION_TOLERANCE
+                        and abs(region["height"] - box["height"]) <= TEMPLATE_POSITION_TOLERANCE
+                        and hamming_distance(region["phash"], phash) <= TEMPLATE_PHASH_MAX_DISTANCE):
+                    if region["last_page"] != page_id:
+                        region["hits"] += 1
+                        region["last_page"] = page_id
+                    region.update(x=box["x"], y=box["y"], width=box["width"], height=box["height"],
+                                  phash=phash, sha=sha, box=box, last_seen=now)
+                    break
+            else:
+                regions.append({"x": box["x"], "y": box["y"], "width": box["width"], "height": box["height"],
+                                "phash": phash, "sha": sha, "box": box, "hits": 1, "last_page": page_id,
+                                "last_seen": now})
+        if len(regions) > TEMPLATE_MAX_REGIONS:
+            regions.sort(key=lambda region: (region.get("last_seen", 0), region["hits"]), reverse=True)
+            del regions[TEMPLATE_MAX_REGIONS:]
@@ -62,6 +62,9 @@ document.addEventListener("DOMContentLoaded", function() {
           const data = JSON.parse(xhr.responseText);
           if (data.execution_time) {
             execTimeDiv.innerText = "Execution Time: " + data.execution_time + " seconds";
+            if (data.reused_pages && data.reused_pages.length > 0) {
+              execTimeDiv.innerText += " (reused unchanged pages: " + data.reused_pages.join(", ") + ")";
+            }
             execTimeDiv.style.display = "block";
           }
           if (data.redirect) {
@@ -0,0 +1,173 @@
+# workers.py
+import os
+import sys
+import math
+import atexit
+import threading
+import multiprocessing
+from collections import deque
+from multiprocessing import cpu_count
+
+# Optional hard cap on OCR worker processes (unset means "use every available core").
+MAX_WORKERS = int(os.environ.get("OCR_MAX_WORKERS", "0")) or None
+
+# Maximum number of OCR jobs (uploads) processed at the same time by this server process.
+# The CPUs are split between the concurrent jobs when sizing each job's pool.
+MAX_CONCURRENT_JOBS = max(int(os.environ.get("OCR_MAX_CONCURRENT_JOBS", "1")), 1)
+# Seconds an upload waits for a free job slot before the server reports it is busy.
+JOB_QUEUE_TIMEOUT = float(os.environ.get("OCR_JOB_QUEUE_TIMEOUT", "300"))
+ocr_job_slots = threading.BoundedSemaphore(MAX_CONCURRENT_JOBS)
+
+# Server-wide OCR pools by name, shared by all jobs once enable_shared_pools() was called (by the server).
+# Without them (scripts, tests) every job creates its own pool.
+_shared_pools = {}
+_shared_pools_enabled = False
+_shared_pools_lock = threading.Lock()
+
+# Thread-count environment variables honoured by the native libraries used in a worker:
+# Tesseract (OpenMP), PyTorch/EasyOCR (OpenMP/MKL) and NumPy (OpenBLAS).
+THREAD_LIMIT_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "OMP_THREAD_LIMIT",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+)
+
+def cgroup_cpu_quota():
+    """
+    Returns the CPU quota of the current container as a (possibly fractional)
+    number of CPUs, or None if no quota is set.
+    Checks cgroup v2 (cpu.max) first and then cgroup v1 (cpu.cfs_quota_us).
+    """
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max" and int(period) > 0:
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read().strip())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read().strip())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+def available_cpu_count():
+    """
+    Returns the number of CPUs this process may actually use: the CPU affinity
+    mask (falling back to cpu_count()), further limited by the cgroup CPU quota.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = cpu_count()
+    quota = cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, max(int(math.ceil(quota)), 1))
+    return max(cpus, 1)
+
+def plan_workers(num_pages, max_workers=None):
+    """
+    Sizes the OCR pool for a document of num_pages pages (or tasks).
+    Returns (num_workers, threads_per_worker), where num_workers never exceeds the
+    page count (nor max_workers, if given) and num_workers * threads_per_worker never exceeds
+    this job's share of the available CPUs (they are split evenly between MAX_CONCURRENT_JOBS jobs).
+    """
+    cpus = max(available_cpu_count() // MAX_CONCURRENT_JOBS, 1)
+    num_workers = max(cpus - 1, 1)
+    if MAX_WORKERS:
+        num_workers = min(num_workers, MAX_WORKERS)
+    if max_workers:
+        num_workers = min(num_workers, max_workers)
+    num_workers = max(min(num_workers, num_pages), 1)
+    threads_per_worker = max(cpus // num_workers, 1)
+    return num_workers, threads_per_worker
+
+def limit_worker_threads(threads_per_worker):
+    """
+    Pool initializer: caps the intra-op thread pools of a worker process so that
+    the workers together do not oversubscribe the CPUs.
+    The environment variables are inherited by the tesseract subprocesses and read by
+    PyTorch/OpenCV when they are imported. Libraries already imported are capped directly,
+    but none are imported here: Tesseract-only workers never load PyTorch or OpenCV.
+    """
+    for var in THREAD_LIMIT_ENV_VARS:
+        os.environ[var] = str(threads_per_worker)
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads_per_worker)
+    if "cv2" in sys.modules:
+        sys.modules["cv2"].setNumThreads(threads_per_worker)
+
+def worker_thread_limit():
+    """The thread cap set by limit_worker_threads in this process, or None."""
+    value = os.environ.get(THREAD_LIMIT_ENV_VARS[0])
+    return int(value) if value and value.isdigit() else None
+
+def pool_context():
+    """
+    Multiprocessing context for the OCR pools: forkserver where available, spawn otherwise.
+    Workers start from a fresh interpreter instead of forking the (multithreaded) server,
+    so they never inherit its locks, threads or an already loaded PyTorch.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+def enable_shared_pools():
+    """Make get_shared_pool() start and share server-wide pools (called once by the server at startup)."""
+    global _shared_pools_enabled
+    _shared_pools_enabled = True
+    atexit.register(stop_shared_pools)
+
+def get_shared_pool(name, max_workers=None, initializer=None, initargs=()):
+    """
+    Return the server-wide pool called name, starting it on first use with enough workers for
+    MAX_CONCURRENT_JOBS jobs of plan_workers(..., max_workers) workers each.
+    Returns None unless enable_shared_pools() was called.
+    Each job keeps its own budget on the pool: see run_with_thread_limit and imap_bounded.
+    """
+    if not _shared_pools_enabled:
+        return None
+    with _shared_pools_lock:
+        pool = _shared_pools.get(name)
+        if pool is None:
+            workers_per_job, _ = plan_workers(sys.maxsize, max_workers)
+            pool = pool_context().Pool(workers_per_job * MAX_CONCURRENT_JOBS, initializer=initializer,
+                                       initargs=initargs)
+            _shared_pools[name] = pool
+        return pool
+
+def stop_shared_pools():
+    with _shared_pools_lock:
+        for pool in _shared_pools.values():
+            pool.terminate()
+            pool.join()
+        _shared_pools.clear()
+
+def run_with_thread_limit(task):
+    """
+    Pool task wrapper: task is (threads_per_worker, func, args). Caps the worker's threads to
+    the job's budget, then returns func(*args). Lets jobs of different sizes share one pool.
+    """
+    threads_per_worker, func, args = task
+    limit_worker_threads(threads_per_worker)
+    return func(*args)
+
+def imap_bounded(pool, func, iterable, max_inflight):
+    """
+    Like pool.imap(func, iterable), but never has more than max_inflight tasks submitted
+    at once, so one job can't fill a shared pool's queue (or memory) with its whole document.
+    """
+    pending = deque()
+    for args in iterable:
+        pending.append(pool.apply_async(func, (args,)))
+        if len(pending) >= max_inflight:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
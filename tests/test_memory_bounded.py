@@ -0,0 +1,145 @@
+# test_memory_bounded.py
+import os
+import sys
+import json
+import time
+import subprocess
+import pytest
+
+if not os.path.exists("/proc/self/status"):
+    pytest.skip("peak RSS is read from /proc (Linux only)", allow_module_level=True)
+for module in ("flask", "pdfplumber", "numpy", "PIL", "pytesseract", "pyzbar.pyzbar"):
+    pytest.importorskip(module)
+
+SCRIPTS_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scrips")
+
+# Peak RSS of the whole process tree (parent, forkserver and pool workers) allowed for a
+# memory-bounded run with MAX_INFLIGHT_PAGES pages in flight, whatever the page count.
+PEAK_RSS_BUDGET_MB = 768
+MAX_INFLIGHT_PAGES = 2
+# How much the peak may grow between the small and the large document.
+PEAK_RSS_GROWTH_MB = 48
+PAGE_COUNTS = (10, 120)
+SAMPLE_INTERVAL = 0.05
+
+def write_pdf(path, num_pages, lines_per_page=40):
+    """Write a synthetic text-only PDF with num_pages letter-size pages."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(num_pages):
+        content = "BT /F1 11 Tf 14 TL 72 740 Td " + " ".join(
+            f"(Page {page + 1} line {line + 1}: synthetic claim text for layout analysis) Tj T*"
+            for line in range(lines_per_page)) + " ET"
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream".encode())
+        content_id = len(objects)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>".encode())
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {num_pages} >>".encode()
+
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref_offset = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    data += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(data)
+
+# Stand-in for the OCR step: it still renders the page, draws and saves its outputs like the
+# real engines. It lives in its own module so pool workers can import it with any start method.
+STUB_MODULE = """
+import pdfplumber
+import dal_ocr_project
+
+def stub_process_page(page_num, pdf_path, pdf_name, render_resolution, json_mode, original_dims,
+                      template_mode=False):
+    with pdfplumber.open(pdf_path) as pdf:
+        image = pdf.pages[page_num].to_image(resolution=render_resolution).original
+    boxes = [{"text": f"Page {page_num + 1}", "x": 10, "y": 10 + 20 * i, "width": 300, "height": 15,
+              "corners": dal_ocr_project.add_corner_points(10, 10 + 20 * i, 300, 15)} for i in range(40)]
+    return dal_ocr_project.save_page_outputs(page_num, image, pdf_name, json_mode, boxes, "text",
+                                             ocr_color="blue", barcode_color="green")
+"""
+
+# Runs in a fresh interpreter, whose process tree is sampled while it runs.
+RUN_SCRIPT = """
+import sys, json
+sys.path[:0] = [{scripts_folder!r}, {workdir!r}]
+import dal_ocr_project
+import stub_ocr
+
+dal_ocr_project.process_page_tesseractOCR = stub_ocr.stub_process_page
+results, _, num_pages, _ = dal_ocr_project.extract_text_and_convert_to_json(
+    {pdf_path!r}, 150, "with_text", None, "tesseract", memory_bounded=True)
+print(json.dumps({{"num_pages": num_pages, "num_results": len(results)}}))
+"""
+
+def process_tree(root_pid):
+    """Pids of root_pid and all its descendants (the pool workers are children of the forkserver)."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        tree.append(pid)
+        stack.extend(children.get(pid, []))
+    return tree
+
+def vm_hwm_kb(pid):
+    """Peak resident set size of a process so far (0 if it has exited)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def peak_rss_mb(tmp_path, num_pages):
+    """
+    Run a memory-bounded extraction of a synthetic num_pages document; returns (report, peak MB).
+    The peak is the largest sum, over the samples, of the peak RSS of the processes alive in the tree.
+    """
+    workdir = tmp_path / f"run_{num_pages}"
+    workdir.mkdir()
+    pdf_path = str(workdir / f"synthetic_{num_pages}.pdf")
+    write_pdf(pdf_path, num_pages)
+    (workdir / "stub_ocr.py").write_text(STUB_MODULE)
+    script = RUN_SCRIPT.format(scripts_folder=SCRIPTS_FOLDER, workdir=str(workdir), pdf_path=pdf_path)
+    env = dict(os.environ, OCR_MAX_INFLIGHT_PAGES=str(MAX_INFLIGHT_PAGES))
+    # Output goes to files: a full pipe would block the run while it is sampled.
+    with open(workdir / "stdout.txt", "w") as stdout, open(workdir / "stderr.txt", "w") as stderr:
+        process = subprocess.Popen([sys.executable, "-c", script], cwd=workdir, env=env, stdout=stdout, stderr=stderr)
+        peak_kb = 0
+        deadline = time.time() + 1800
+        while process.poll() is None and time.time() < deadline:
+            peak_kb = max(peak_kb, sum(vm_hwm_kb(pid) for pid in process_tree(process.pid)))
+            time.sleep(SAMPLE_INTERVAL)
+        if process.poll() is None:
+            process.kill()
+    assert process.wait() == 0, (workdir / "stderr.txt").read_text()
+    report = json.loads((workdir / "stdout.txt").read_text().strip().splitlines()[-1])
+    return report, peak_kb / 1024
+
+def test_peak_rss_stays_under_budget_as_page_count_grows(tmp_path):
+    peaks = []
+    for num_pages in PAGE_COUNTS:
+        report, peak = peak_rss_mb(tmp_path, num_pages)
+        assert report["num_pages"] == num_pages
+        assert report["num_results"] == num_pages
+        assert peak < PEAK_RSS_BUDGET_MB, f"{num_pages} pages peaked at {peak:.0f} MB"
+        peaks.append(peak)
+    assert peaks[-1] - peaks[0] < PEAK_RSS_GROWTH_MB, f"peak RSS grew from {peaks[0]:.0f} to {peaks[-1]:.0f} MB"